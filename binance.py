@@ -1,36 +1,76 @@
 import hmac
 import hashlib
 import time
-import requests
 from decimal import Decimal
 from urllib.parse import urlencode
 from .base import Balance, Order, Trade
+from .fanout import for_symbols
+from .singleflight import coalesce, coalescing_stats
+from .transport import default_transport
+from .resilience import Resilience
+from .candles import Candles
 from datetime import datetime
 
 
 class Binance(object):
     URL = 'https://api.binance.com/api/'
+    SAPI_URL = 'https://api.binance.com/sapi/'
+    RATE_LIMIT = 20
+    MARKET_DATA_TTL = 0.05
+    METADATA_TTL = 60
 
-    def __init__(self, auth):
+    def __init__(self, auth, cache=None, resilience=None, transport=None):
         self._secret = auth.get_secret()
         self._key = auth.get_key()
-
-    def signed_request(self, method, path, params):
-        query = urlencode(params)
-        query += "&timestamp={}".format(int(time.time() * 1000))
-        secret = bytes(self._secret.encode("utf-8"))
-        signature = hmac.new(secret, query.encode("utf-8"),
-                             hashlib.sha256).hexdigest()
-        query += "&signature={}".format(signature)
-        resp = requests.request(method,
-                                self.URL + path + "?" + query,
-                                headers={"X-MBX-APIKEY": self._key}).json()
-        return resp
+        self._cache = cache
+        self._resilience = resilience or Resilience()
+        self._transport = transport or default_transport()
+        self.ledger = None
+
+    def _send(self, method, path, send, hedge=False):
+        try:
+            resp = self._resilience.call(path.lstrip('/'), send, idempotent=method == 'GET', hedge=hedge)
+        except Exception as e:
+            return {'code': -1, 'msg': str(e)}
+        try:
+            return resp.json()
+        except ValueError:
+            return {'code': resp.status_code, 'msg': resp.text}
+
+    def signed_request(self, method, path, params, url=None):
+        url = url or self.URL
+
+        def send(timeout):
+            query = urlencode(params)
+            query += "&timestamp={}".format(int(time.time() * 1000))
+            secret = bytes(self._secret.encode("utf-8"))
+            signature = hmac.new(secret, query.encode("utf-8"),
+                                 hashlib.sha256).hexdigest()
+            query += "&signature={}".format(signature)
+            return self._transport.request(method,
+                                           url + path + "?" + query,
+                                           headers={"X-MBX-APIKEY": self._key},
+                                           timeout=timeout)
+        return self._send(method, path, send)
 
     def request(self, method, path, params=None):
-        resp = requests.request(method, self.URL + path, params=params)
-        data = resp.json()
-        return data
+        def send(timeout):
+            return self._transport.request(method, self.URL + path, params=params, timeout=timeout)
+        return self._send(method, path, send, hedge=True)
+
+    def _track_order(self, order, market=False):
+        if self.ledger is not None and order is not None:
+            if market:
+                self.ledger.on_market_fill(order)
+            else:
+                self.ledger.on_order_placed(order)
+        return order
+
+    def coalescing_stats(self):
+        return coalescing_stats(self)
+
+    def for_symbols(self, method, symbols, max_concurrency=8, key=None, **kwargs):
+        return for_symbols(self, method, symbols, max_concurrency, key, **kwargs)
 
     def apply_fee(self, order):
         if order.order_type == "sell":
@@ -40,12 +80,14 @@ class Binance(object):
         return order
 
     def _get_order_symbol(self, order_id):
-        for order in self.get_open_orders():
+        for order in self.get_open_orders() or []:
             if order.number == order_id:
                 return order.symbol
 
     def get_full_balance(self):
         balances = self.get_balance()
+        if balances is None:
+            return None
 
         result = []
         for balance in balances:
@@ -56,11 +98,15 @@ class Binance(object):
     def get_balance(self):
         data = self.signed_request("GET", "v3/account", {})
         result = []
+        if 'balances' not in data:
+            print(data)
+            return None
         for balance in data['balances']:
             if Decimal(balance['free']) != 0 or Decimal(balance['locked']) != 0:
                 result.append(balance)
         return result
 
+    @coalesce('MARKET_DATA_TTL')
     def get_tickers(self, currency=None):
         if not currency:
             return self.request('GET', 'v1/ticker/24hr', {})
@@ -85,11 +131,12 @@ class Binance(object):
             if market:
                 data['price'] = data['fills'][0]['price']
             print(data)
-            return BinanceOrder.create_object_from_json(data)
+            return self._track_order(BinanceOrder.create_object_from_json(data), market)
         else:
             print(data['msg'], params)
             return None
 
+    @coalesce('MARKET_DATA_TTL')
     def get_orderbook(self, symbol):
         data = self.request('GET', 'v3/ticker/bookTicker', {'symbol': symbol})
 
@@ -97,38 +144,144 @@ class Binance(object):
             return data
         return None
 
-    def get_filters(self):
-        data = self.request('GET', 'v1/exchangeInfo', {})
+    @coalesce('MARKET_DATA_TTL')
+    def get_all_tickers(self):
+        data = self.request('GET', 'v1/ticker/24hr', {})
 
-        result = []
-        if 'symbols' in data:
-            for d in data["symbols"]:
-                filters = {
-                    "min_price": 0.00000001,
-                    "min_amount": 0.00000001,
-                    "min_lot": 0.00000001,
-                    "pairs": d["symbol"],
-                    "exchange": "Binance"
-                }
-                for f in d["filters"]:
-                    if f["filterType"] == "PRICE_FILTER":
-                        filters["min_price"] = Decimal("{}".format(float(f["minPrice"])))
-                    elif f["filterType"] == "LOT_SIZE":
-                        filters["min_amount"] = Decimal("{}".format(float(f["minQty"])))
-                    elif f["filterType"] == "MIN_NOTIONAL":
-                        filters["min_lot"] = Decimal("{}".format(float(f["minNotional"])))
-                print(filters)
-                result.append(filters)
+        result = {}
+        if not isinstance(data, list):
+            print(data)
+            return result
+        for ticker in data:
+            result[ticker['symbol']] = {
+                'last': Decimal(ticker['lastPrice']),
+                'bid': Decimal(ticker['bidPrice']),
+                'ask': Decimal(ticker['askPrice']),
+                'volume': Decimal(ticker['volume']),
+            }
+        return result
+
+    @coalesce('MARKET_DATA_TTL')
+    def get_best_bid_ask(self, symbols=None):
+        data = self.request('GET', 'v3/ticker/bookTicker', {})
+
+        result = {}
+        if not isinstance(data, list):
+            print(data)
             return result
-        print(data)
+        for ticker in data:
+            if symbols is not None and ticker['symbol'] not in symbols:
+                continue
+            result[ticker['symbol']] = {
+                'bid': Decimal(ticker['bidPrice']),
+                'bid_size': Decimal(ticker['bidQty']),
+                'ask': Decimal(ticker['askPrice']),
+                'ask_size': Decimal(ticker['askQty']),
+            }
+        return result
+
+    @coalesce('MARKET_DATA_TTL')
+    def get_depth(self, symbol, limit=20):
+        data = self.request('GET', 'v3/depth', {'symbol': symbol, 'limit': limit})
+
+        if 'bids' in data:
+            return {
+                'bids': [(Decimal(d[0]), Decimal(d[1])) for d in data['bids']],
+                'asks': [(Decimal(d[0]), Decimal(d[1])) for d in data['asks']],
+            }
         return None
 
-    def get_feeinfo(self):
+    def get_orderbooks(self, symbols, max_concurrency=8):
+        result = {}
+        for symbol, book, error in self.for_symbols(self.get_depth, symbols, max_concurrency):
+            if error is None and book is not None:
+                result[symbol] = book
+        return result
+
+    def get_klines(self, symbol, interval, start, end=None, limit=1000):
+        end = end or int(time.time() * 1000)
+        result = Candles(interval)
+        params = {'symbol': symbol, 'interval': interval, 'startTime': start, 'endTime': end - 1, 'limit': limit}
+        while True:
+            data = self.request('GET', 'v3/klines', params)
+            if not isinstance(data, list):
+                print(data)
+                return None
+            for k in data:
+                result.append(k[0], k[1], k[2], k[3], k[4], k[5])
+            if len(data) < limit:
+                return result
+            params['startTime'] = data[-1][0] + 1
+
+    @coalesce('METADATA_TTL')
+    def _get_exchange_info(self):
+        # One exchangeInfo download feeds both the filters and the asset views
+        if self._cache is not None:
+            return self._cache.get('Binance', 'exchange_info', self._fetch_exchange_info)
+        return self._fetch_exchange_info()
+
+    def _fetch_exchange_info(self):
+        data = self.request('GET', 'v1/exchangeInfo', {})
+        if 'symbols' not in data:
+            print(data)
+            return None
+        return data['symbols']
+
+    @coalesce('METADATA_TTL')
+    def get_filters(self):
+        symbols = self._get_exchange_info()
+        if symbols is None:
+            return None
+        result = []
+        for d in symbols:
+            filters = {
+                "min_price": 0.00000001,
+                "min_amount": 0.00000001,
+                "min_lot": 0.00000001,
+                "pairs": d["symbol"],
+                "exchange": "Binance"
+            }
+            for f in d["filters"]:
+                if f["filterType"] == "PRICE_FILTER":
+                    filters["min_price"] = Decimal("{}".format(float(f["minPrice"])))
+                elif f["filterType"] == "LOT_SIZE":
+                    filters["min_amount"] = Decimal("{}".format(float(f["minQty"])))
+                elif f["filterType"] == "MIN_NOTIONAL":
+                    filters["min_lot"] = Decimal("{}".format(float(f["minNotional"])))
+            result.append(filters)
+        return result
+
+    @coalesce('METADATA_TTL')
+    def get_symbol_assets(self):
+        symbols = self._get_exchange_info()
+        if symbols is None:
+            return None
+        return dict((d['symbol'], (d['baseAsset'], d['quoteAsset'])) for d in symbols)
+
+    def get_feeinfo(self, symbol=None):
+        if symbol is not None:
+            return self.get_fee_schedule([symbol]).get(symbol)
         data = self.signed_request('GET', 'v3/account', {})
         if "makerCommission" in data:
             return {"maker_fee": Decimal(data["makerCommission"])/10000, "taker_fee": Decimal(data["takerCommission"])/10000}
         return None
 
+    def get_fee_schedule(self, symbols=None):
+        params = {'symbol': symbols[0]} if symbols and len(symbols) == 1 else {}
+        data = self.signed_request('GET', 'v1/asset/tradeFee', params, url=self.SAPI_URL)
+        result = {}
+        if not isinstance(data, list):
+            print(data)
+            return result
+        for fee in data:
+            if symbols is not None and fee['symbol'] not in symbols:
+                continue
+            result[fee['symbol']] = {
+                'maker_fee': Decimal(fee['makerCommission']),
+                'taker_fee': Decimal(fee['takerCommission']),
+            }
+        return result
+
     def get_last_price(self, symbol, action, amount):
         pass
 
@@ -136,6 +289,9 @@ class Binance(object):
         data = self.signed_request('GET', 'v3/openOrders', {})
 
         result = []
+        if not isinstance(data, list):
+            print(data)
+            return None
         for order in data:
             result.append(BinanceOrder.create_object_from_json(order))
         return result
@@ -150,6 +306,8 @@ class Binance(object):
 
         print(result)
         if 'clientOrderId' in result:
+            if self.ledger is not None:
+                self.ledger.on_cancel(order)
             return True
         return False
 
@@ -186,20 +344,53 @@ class Binance(object):
             'symbol': self._get_order_symbol(order.number)
         }
         data = self.signed_request("GET", "/v3/order", params)
-        if data['status'] == 'FILLED':
+        if data.get('status') == 'FILLED':
+            if self.ledger is not None:
+                self.ledger.on_fill(order)
             return True
         return False
 
+    def get_execution(self, order, symbol=None):
+        params = {'orderId': order.number, 'symbol': symbol or self._get_order_symbol(order.number)}
+        data = self.signed_request("GET", "/v3/order", params)
+        if 'executedQty' not in data:
+            print(data)
+            return None
+        return {'amount': Decimal(data['executedQty']), 'notional': Decimal(data['cummulativeQuoteQty'])}
+
     def get_trade_history(self, start=None, end=None, limit=1000, pairs=None):
         if pairs is not None:
             data = self.signed_request('GET', 'v3/myTrades', {'symbol': pairs})
             result = []
+            if not isinstance(data, list):
+                print(data)
+                return result
             for trade in data:
                 result.append(BinanceTrade.create_object_from_json(trade))
             return result
         else:
             return None
 
+    def get_fills(self, symbol, since_id=None, since_time=None, limit=1000):
+        params = {'symbol': symbol, 'limit': limit, 'fromId': 0 if since_id is None else int(since_id) + 1}
+        result = []
+        while True:
+            data = self.signed_request('GET', 'v3/myTrades', params)
+            if not isinstance(data, list):
+                print(data)
+                return None
+            for trade in data:
+                result.append({
+                    'id': trade['id'], 'symbol': symbol, 'order_id': trade['orderId'],
+                    'side': 'buy' if trade['isBuyer'] else 'sell',
+                    'price': trade['price'], 'amount': trade['qty'],
+                    'fee': trade['commission'], 'fee_asset': trade['commissionAsset'],
+                    'time': trade['time'],
+                })
+            if len(data) < limit:
+                return result
+            params['fromId'] = data[-1]['id'] + 1
+
     def close_order(self, order):
         is_closed = self.cancel_order(order)
         if not is_closed:
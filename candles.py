@@ -0,0 +1,188 @@
+import bisect
+import os
+import struct
+import threading
+from array import array
+
+from .metacache import DEFAULT_PATH
+
+INTERVALS = {
+    '1m': 60, '5m': 300, '15m': 900, '30m': 1800,
+    '1h': 3600, '4h': 14400, '1d': 86400, '1w': 604800,
+}
+
+FILE_HEADER = struct.Struct('<4sQ')
+MAGIC = b'OHL1'
+
+
+def interval_ms(interval):
+    return INTERVALS[interval] * 1000
+
+
+class Candles(object):
+    FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.time = array('q')
+        self.open = array('d')
+        self.high = array('d')
+        self.low = array('d')
+        self.close = array('d')
+        self.volume = array('d')
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, time, open, high, low, close, volume):
+        if self.time and time <= self.time[-1]:
+            if time == self.time[-1]:
+                # The venue re-sends the still forming bar, keep the latest version
+                self.open[-1], self.high[-1], self.low[-1] = float(open), float(high), float(low)
+                self.close[-1], self.volume[-1] = float(close), float(volume)
+            return
+        self.time.append(int(time))
+        self.open.append(float(open))
+        self.high.append(float(high))
+        self.low.append(float(low))
+        self.close.append(float(close))
+        self.volume.append(float(volume))
+
+    def extend(self, other):
+        for i in range(len(other)):
+            self.append(other.time[i], other.open[i], other.high[i], other.low[i], other.close[i], other.volume[i])
+
+    def slice(self, start=None, end=None):
+        lo = 0 if start is None else bisect.bisect_left(self.time, start)
+        hi = len(self.time) if end is None else bisect.bisect_left(self.time, end)
+        result = Candles(self.interval)
+        result.time = self.time[lo:hi]
+        for field in self.FIELDS:
+            setattr(result, field, getattr(self, field)[lo:hi])
+        return result
+
+    def to_numpy(self):
+        import numpy
+        # frombuffer shares the array memory instead of copying it
+        columns = dict((f, numpy.frombuffer(getattr(self, f), dtype=numpy.float64)) for f in self.FIELDS)
+        columns['time'] = numpy.frombuffer(self.time, dtype=numpy.int64)
+        return columns
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(FILE_HEADER.pack(MAGIC, len(self.time)))
+            self.time.tofile(f)
+            for field in self.FIELDS:
+                getattr(self, field).tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, interval):
+        result = cls(interval)
+        with open(path, 'rb') as f:
+            magic, count = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a candle file".format(path))
+            result.time.fromfile(f, count)
+            for field in cls.FIELDS:
+                getattr(result, field).fromfile(f, count)
+        return result
+
+
+def resample(candles, interval):
+    step = interval_ms(interval)
+    if step % interval_ms(candles.interval):
+        raise ValueError("Can't resample {} bars into {}".format(candles.interval, interval))
+    result = Candles(interval)
+    bucket = None
+    for i in range(len(candles)):
+        start = candles.time[i] - candles.time[i] % step
+        if start != bucket:
+            if bucket is not None:
+                result.append(bucket, o, h, l, c, v)
+            bucket, o, h, l, c, v = (start, candles.open[i], candles.high[i], candles.low[i],
+                                     candles.close[i], candles.volume[i])
+        else:
+            h = max(h, candles.high[i])
+            l = min(l, candles.low[i])
+            c = candles.close[i]
+            v += candles.volume[i]
+    if bucket is not None:
+        result.append(bucket, o, h, l, c, v)
+    return result
+
+
+def from_trades(trades, interval):
+    # trades are get_fills style rows: dicts with time (ms), price and amount
+    step = interval_ms(interval)
+    result = Candles(interval)
+    bucket = None
+    for trade in sorted(trades, key=lambda t: t['time']):
+        price, amount = float(trade['price']), float(trade['amount'])
+        start = int(trade['time']) - int(trade['time']) % step
+        if start != bucket:
+            if bucket is not None:
+                result.append(bucket, o, h, l, c, v)
+            bucket, o, h, l, c, v = start, price, price, price, price, amount
+        else:
+            h = max(h, price)
+            l = min(l, price)
+            c = price
+            v += amount
+    if bucket is not None:
+        result.append(bucket, o, h, l, c, v)
+    return result
+
+
+class CandleCache(object):
+
+    def __init__(self, path=os.path.join(DEFAULT_PATH, 'candles')):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, venue, symbol, interval):
+        return os.path.join(self.path, '{}_{}_{}.ohlc'.format(venue.lower(), symbol, interval))
+
+    def _floor(self, filename):
+        try:
+            with open(filename + '.floor') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _set_floor(self, filename, time):
+        with open(filename + '.floor', 'w') as f:
+            f.write(str(int(time)))
+
+    def get(self, client, symbol, interval, start, end):
+        venue = type(client).__name__
+        filename = self._file(venue, symbol, interval)
+        step = interval_ms(interval)
+        with self._lock:
+            try:
+                candles = Candles.load(filename, interval)
+            except (OSError, ValueError):
+                candles = Candles(interval)
+
+            changed = False
+            floor = self._floor(filename)
+            if not len(candles) or (start < candles.time[0] and floor is None):
+                head = client.get_klines(symbol, interval, start, candles.time[0] if len(candles) else end)
+                if head is not None and len(head):
+                    head.extend(candles)
+                    candles, changed = head, True
+                if head is not None and len(candles) and candles.time[0] - start >= step:
+                    # The venue has nothing older (Kraken keeps 720 bars, Huobi has no time range),
+                    # so later calls stop asking for the head
+                    self._set_floor(filename, candles.time[0])
+            if len(candles) and candles.time[-1] + step < end:
+                # Refetch the last cached bar too, it may have been saved while still open
+                tail = client.get_klines(symbol, interval, candles.time[-1], end)
+                if tail is not None and len(tail):
+                    candles.extend(tail)
+                    changed = True
+            if changed:
+                candles.save(filename)
+        return candles.slice(start, end)
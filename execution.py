@@ -0,0 +1,234 @@
+import heapq
+import itertools
+import threading
+import time
+from decimal import Decimal
+
+
+class ParentOrder(object):
+
+    def __init__(self, client, symbol, order_type, amount, interval=1.0):
+        self.client = client
+        self.symbol = symbol
+        self.order_type = order_type
+        self.amount = Decimal(amount)
+        self.interval = interval
+        self.filled = Decimal(0)
+        self.children = []
+        self.done = False
+        self.cancelled = False
+        self._working = {}
+
+    @property
+    def remaining(self):
+        return self.amount - self.filled
+
+    @property
+    def outstanding(self):
+        return sum((Decimal(entry[0].amount) - entry[1] for entry in self._working.values()), Decimal(0))
+
+    def _place(self, rate, amount, market=False):
+        order = self.client.new_order(rate, self.order_type, amount, self.symbol, market=market)
+        if order is not None:
+            self.children.append(order)
+            if market:
+                self.filled += amount
+            else:
+                # [order, amount already counted, cancel accepted]
+                self._working[str(order.number)] = [order, Decimal(0), False]
+        return order
+
+    def _poll(self):
+        # Resting children count toward the parent only once the venue reports them filled
+        for number, entry in list(self._working.items()):
+            if entry[2]:
+                self._settle(number, entry)
+            elif self.client.is_order_fulfilled(entry[0]):
+                self.filled += Decimal(entry[0].amount) - entry[1]
+                del self._working[number]
+
+    def _settle(self, number, entry):
+        # A child may have filled, fully or partly, before the cancel reached the venue
+        order = entry[0]
+        execution = self.client.get_execution(order, self.symbol)
+        if execution is None:
+            return
+        self.filled += execution['amount'] - entry[1]
+        entry[1] = execution['amount']
+        # A child whose cancel failed may still be live, it stays tracked until it is gone
+        if entry[2] or execution['amount'] >= Decimal(order.amount):
+            del self._working[number]
+
+    def _cancel_working(self):
+        for number, entry in list(self._working.items()):
+            if not entry[2]:
+                entry[2] = bool(self.client.cancel_order(entry[0]))
+            self._settle(number, entry)
+
+    def _reference(self, scheduler):
+        # Market children still carry a price: venues size market buys and build the order from it
+        quote = scheduler.quote(self.client, self.symbol)
+        if quote is None:
+            return None
+        return quote['ask'] if self.order_type == 'buy' else quote['bid']
+
+    def cancel(self):
+        self.cancelled = True
+        self._cancel_working()
+        self.done = True
+
+    def step(self, scheduler, now):
+        raise NotImplementedError
+
+
+class Twap(ParentOrder):
+
+    def __init__(self, client, symbol, order_type, amount, duration, slices, rate=None):
+        super(Twap, self).__init__(client, symbol, order_type, amount, duration / float(slices))
+        self.slice = self.amount / slices
+        self.slices = slices
+        self.rate = rate
+        self.placed = 0
+        self.swept = False
+
+    def step(self, scheduler, now):
+        self._poll()
+        if self.placed < self.slices:
+            amount = min(self.slice, self.remaining - self.outstanding)
+            rate = self.rate if self.rate is not None else self._reference(scheduler)
+            if rate is None:
+                return now + self.interval
+            # Counted before placing, so a placement that raises is never resent
+            self.placed += 1
+            if amount > 0:
+                self._place(rate, amount, market=self.rate is None)
+        else:
+            # Limit slices still resting after the schedule are pulled and the rest is sent at market
+            self._cancel_working()
+            if self._working:
+                return now + self.interval
+            if self.remaining > 0 and not self.swept:
+                rate = self._reference(scheduler)
+                if rate is None:
+                    return now + self.interval
+                self.swept = True
+                self._place(rate, self.remaining, market=True)
+        if self.remaining <= 0 or (self.placed >= self.slices and not self._working and self.swept):
+            self.done = True
+            return None
+        return now + self.interval
+
+
+class Iceberg(ParentOrder):
+
+    def __init__(self, client, symbol, order_type, amount, visible, rate, interval=1.0):
+        super(Iceberg, self).__init__(client, symbol, order_type, amount, interval)
+        self.visible = Decimal(visible)
+        self.rate = rate
+
+    def step(self, scheduler, now):
+        self._poll()
+        if self._working:
+            return now + self.interval
+        if self.remaining <= 0:
+            self.done = True
+            return None
+        self._place(self.rate, min(self.visible, self.remaining))
+        return now + self.interval
+
+
+class Peg(ParentOrder):
+
+    def __init__(self, client, symbol, order_type, amount, threshold, offset=0, interval=1.0):
+        super(Peg, self).__init__(client, symbol, order_type, amount, interval)
+        self.threshold = Decimal(threshold)
+        self.offset = Decimal(offset)
+
+    def _target(self, quote):
+        if self.order_type == 'buy':
+            return quote['bid'] + self.offset
+        return quote['ask'] - self.offset
+
+    def step(self, scheduler, now):
+        self._poll()
+        if self.remaining <= 0:
+            self.done = True
+            return None
+        quote = scheduler.quote(self.client, self.symbol)
+        if quote is None:
+            return now + self.interval
+        target = self._target(quote)
+        if self._working:
+            child = next(iter(self._working.values()))[0]
+            if abs(target - Decimal(child.rate)) <= self.threshold:
+                return now + self.interval
+            # Requote only once the book has moved past the threshold. The child is cancelled and
+            # its fills counted first, so the new order covers only what is still unfilled
+            self._cancel_working()
+        if not self._working and self.remaining > 0:
+            self._place(target, self.remaining)
+        return now + self.interval
+
+
+class ExecutionScheduler(object):
+
+    def __init__(self, quote_ttl=0.5):
+        self.quote_ttl = quote_ttl
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._quotes = {}
+        self._thread = None
+        self._stop = False
+
+    def submit(self, parent, delay=0):
+        with self._cond:
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._counter), parent))
+            self._cond.notify()
+        return parent
+
+    def quote(self, client, symbol):
+        # One bulk quote request per venue per tick is shared by every pegged order on it
+        fetched, quotes = self._quotes.get(id(client), (0, {}))
+        if time.monotonic() - fetched > self.quote_ttl or symbol not in quotes:
+            with self._cond:
+                symbols = set(p.symbol for _, _, p in self._queue if p.client is client) | {symbol}
+            quotes = client.get_best_bid_ask(symbols)
+            self._quotes[id(client)] = (time.monotonic(), quotes)
+        return quotes.get(symbol)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    self._cond.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                if self._stop:
+                    return
+                _, _, parent = heapq.heappop(self._queue)
+            if parent.done:
+                continue
+            try:
+                due = parent.step(self, time.monotonic())
+            except Exception as e:
+                print("Execution of {} {} failed: {}".format(parent.order_type, parent.symbol, e))
+                due = time.monotonic() + parent.interval
+            if due is not None and not parent.done:
+                with self._cond:
+                    heapq.heappush(self._queue, (due, next(self._counter), parent))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, cancel=True):
+        with self._cond:
+            self._stop = True
+            parents = [p for _, _, p in self._queue]
+            self._queue = []
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if cancel:
+            for parent in parents:
+                parent.cancel()
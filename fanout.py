@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+POOL_SIZE = 32
+
+_pool = ThreadPoolExecutor(max_workers=POOL_SIZE)
+
+
+def get_pool():
+    return _pool
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+
+def get_limiter(client):
+    limiter = client.__dict__.get('_limiter')
+    if limiter is None:
+        limiter = client.__dict__.setdefault('_limiter', RateLimiter(getattr(client, 'RATE_LIMIT', None)))
+    return limiter
+
+
+def for_symbols(client, method, symbols, max_concurrency=8, key=None, **kwargs):
+    if isinstance(method, str):
+        method = getattr(client, method)
+    limiter = get_limiter(client)
+
+    def call(symbol):
+        limiter.acquire()
+        if key is None:
+            return method(symbol, **kwargs)
+        return method(**dict(kwargs, **{key: symbol}))
+
+    symbols = iter(symbols)
+    running = {}
+
+    def submit():
+        for symbol in symbols:
+            running[_pool.submit(call, symbol)] = symbol
+            return True
+        return False
+
+    for _ in range(max(1, min(max_concurrency, POOL_SIZE))):
+        if not submit():
+            break
+
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            symbol = running.pop(future)
+            error = future.exception()
+            yield symbol, (None if error else future.result()), error
+            submit()
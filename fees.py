@@ -0,0 +1,58 @@
+import threading
+import time
+from decimal import Decimal
+
+
+def _symbol_name(symbol):
+    return getattr(symbol, 'name', symbol)
+
+
+class FeeEngine(object):
+
+    def __init__(self, client, ttl=3600):
+        self.client = client
+        self.ttl = ttl
+        self._schedule = {}
+        self._default = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        schedule = self.client.get_fee_schedule()
+        default = self.client.get_feeinfo()
+        with self._lock:
+            if schedule:
+                self._schedule = schedule
+            if default:
+                self._default = dict((k, Decimal("{}".format(v))) for k, v in default.items())
+            self._loaded_at = time.monotonic()
+
+    def schedule(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh()
+        return self._schedule
+
+    def get(self, symbol):
+        fee = self.schedule().get(_symbol_name(symbol))
+        return fee if fee is not None else self._default
+
+    def rates(self, symbols, taker=True):
+        schedule = self.schedule()
+        key = 'taker_fee' if taker else 'maker_fee'
+        default = self._default[key] if self._default else Decimal(0)
+        return [schedule[s][key] if s in schedule else default for s in map(_symbol_name, symbols)]
+
+    def apply(self, orders, taker=True):
+        # Same arithmetic as the clients' apply_fee, with the order's own symbol rate
+        rates = self.rates([o.symbol for o in orders], taker)
+        for order, rate in zip(orders, rates):
+            if order.order_type == "sell":
+                order.total = Decimal(order.total) * (Decimal(1) - rate)
+            elif order.order_type == "buy":
+                order.total = Decimal(order.total) * (Decimal(1) + rate)
+        return orders
+
+    def net_totals(self, symbols, order_types, totals, taker=True):
+        rates = self.rates(symbols, taker)
+        return [Decimal(total) * (Decimal(1) - rate if order_type == 'sell' else Decimal(1) + rate)
+                for order_type, total, rate in zip(order_types, totals, rates)]
@@ -4,30 +4,55 @@ import json
 import base64
 import urllib
 import urllib.parse
-import requests
 import datetime
 from decimal import Decimal
 from .base import Trade, Balance, Order, MarginPosition, MarginInfo
+from .fanout import for_symbols
+from .singleflight import coalesce, coalescing_stats
+from .margin import MarginBook
+from .transport import default_transport
+from .resilience import Resilience, endpoint_key, failed_response
+from .candles import Candles
 
 
 class Huobi(object):
     MARKET_URL = "https://api.huobi.pro"
     TRADE_URL = "https://api.huobi.pro"
-
-    def __init__(self, auth):
+    RATE_LIMIT = 10
+    MARKET_DATA_TTL = 0.05
+    METADATA_TTL = 60
+    KLINE_PERIODS = {
+        '1m': '1min', '5m': '5min', '15m': '15min', '30m': '30min',
+        '1h': '60min', '4h': '4hour', '1d': '1day', '1w': '1week',
+    }
+
+    def __init__(self, auth, cache=None, resilience=None, transport=None):
         self._secret = auth.get_secret()
         self._key = auth.get_key()
-
-    def http_get_request(self, url, params, add_to_headers=None):
+        self._cache = cache
+        self._resilience = resilience or Resilience()
+        self._transport = transport or default_transport()
+        self.ledger = None
+        self.margin = MarginBook()
+        self._margin_orders = {}
+
+    def _send(self, url, send, idempotent, hedge=False):
+        try:
+            return self._resilience.call(endpoint_key(url), send, idempotent=idempotent, hedge=hedge)
+        except Exception as e:
+            return failed_response(url, e)
+
+    def http_get_request(self, url, params, add_to_headers=None, hedge=False):
         headers = {
             "Content-type": "application/x-www-form-urlencoded",
-            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.71 Safari/537.36',
         }
         if add_to_headers:
             headers.update(add_to_headers)
         postdata = urllib.parse.urlencode(params)
-        response = requests.get(url, postdata, headers=headers)
-        return response
+
+        def send(timeout):
+            return self._transport.request('GET', url, params=postdata, headers=headers, timeout=timeout)
+        return self._send(url, send, idempotent=True, hedge=hedge)
 
     def decimal_default(self, obj):
         if isinstance(obj, Decimal):
@@ -42,8 +67,10 @@ class Huobi(object):
         if add_to_headers:
             headers.update(add_to_headers)
         postdata = json.dumps(params, default=self.decimal_default)
-        response = requests.post(url, postdata, headers=headers)
-        return response
+
+        def send(timeout):
+            return self._transport.request('POST', url, data=postdata, headers=headers, timeout=timeout)
+        return self._send(url, send, idempotent=False)
 
     def api_key_get(self, params, request_path):
         method = 'GET'
@@ -89,15 +116,45 @@ class Huobi(object):
         signature = signature.decode()
         return signature
 
+    def _track_order(self, order, market=False):
+        if self.ledger is not None and order is not None:
+            if market:
+                self.ledger.on_market_fill(order)
+            else:
+                self.ledger.on_order_placed(order)
+        return order
+
+    def coalescing_stats(self):
+        return coalescing_stats(self)
+
+    def for_symbols(self, method, symbols, max_concurrency=8, key=None, **kwargs):
+        return for_symbols(self, method, symbols, max_concurrency, key, **kwargs)
+
+    @coalesce('MARKET_DATA_TTL')
     def get_orderbook(self, symbol):
         params = {'symbol': symbol,
                   'type': 'step0'}
         url = self.MARKET_URL + '/market/depth'
-        result = self.http_get_request(url, params)
+        result = self.http_get_request(url, params, hedge=True)
         if result.status_code != 200:
             return None
         return result.json()
 
+    def get_klines(self, symbol, interval, start, end=None, size=2000):
+        # market/history/kline has no time range, it returns the latest `size` bars only
+        url = self.MARKET_URL + '/market/history/kline'
+        params = {'symbol': symbol, 'period': self.KLINE_PERIODS[interval], 'size': size}
+        result = self.http_get_request(url, params, hedge=True)
+        if result.status_code != 200 or result.json()['status'] != 'ok':
+            print(result.json())
+            return None
+        candles = Candles(interval)
+        for k in reversed(result.json()['data']):
+            t = k['id'] * 1000
+            if t >= start and (end is None or t < end):
+                candles.append(t, k['open'], k['high'], k['low'], k['close'], k['amount'])
+        return candles
+
     def apply_fee(self, order):
         if order.order_type == "sell":
             order.total = Decimal(order.total) * (Decimal(1.0) - order.exchange.taker_fee)
@@ -105,21 +162,59 @@ class Huobi(object):
             order.total = Decimal(order.total) * (Decimal(1.0) + order.exchange.taker_fee)
         return order
 
-    def get_feeinfo(self):
+    def get_feeinfo(self, symbol=None):
+        if symbol is not None:
+            return self.get_fee_schedule([symbol]).get(symbol)
         return {
             'maker_fee': 0.002,
             'taker_fee': 0.002
         }
 
-    def get_filters(self):
-        url = "https://api.huobi.pro/v1/common/symbols"
-        resp = requests.get(url)
+    def _get_fee_rates(self, symbols):
+        path = '/v2/reference/transact-fee-rate'
+        data = self.api_key_get({'symbols': ','.join(symbols)}, path)
+        if data.status_code != 200 or data.json().get('code') != 200:
+            print(data.json())
+            return []
+        return data.json()['data']
+
+    def get_fee_schedule(self, symbols=None):
+        symbols = symbols or self.get_symbols() or []
+        # The endpoint takes at most 10 symbols per call
+        chunks = [tuple(symbols[i:i + 10]) for i in range(0, len(symbols), 10)]
+        result = {}
+        for chunk, rates, error in self.for_symbols(self._get_fee_rates, chunks):
+            if error is not None:
+                print(error)
+                continue
+            for rate in rates:
+                result[rate['symbol']] = {
+                    'maker_fee': Decimal(rate.get('actualMakerRate') or rate['makerFeeRate']),
+                    'taker_fee': Decimal(rate.get('actualTakerRate') or rate['takerFeeRate']),
+                }
+        return result
+
+    @coalesce('METADATA_TTL')
+    def _get_common_symbols(self):
+        # One /v1/common/symbols download feeds the symbol, asset and filter views
+        if self._cache is not None:
+            return self._cache.get('Huobi', 'common_symbols', self._fetch_common_symbols)
+        return self._fetch_common_symbols()
+
+    def _fetch_common_symbols(self):
+        resp = self.http_get_request(self.MARKET_URL + "/v1/common/symbols", {})
         if resp.status_code != 200:
             print(resp.json())
             return None
+        return resp.json()["data"]
 
+    @coalesce('METADATA_TTL')
+    def get_filters(self):
+        symbols = self._get_common_symbols()
+        if symbols is None:
+            return None
         result = []
-        for f in resp.json()["data"]:
+        for f in symbols:
             result.append({
                 "min_price": Decimal("{}".format(1/10**f["price-precision"])),
                 "min_amount": Decimal("{}".format(1/10**f["amount-precision"])),
@@ -150,6 +245,8 @@ class Huobi(object):
 
     def new_order(self, rate, order_type, amount, symbol, market=False):
         accounts = self._get_accounts()
+        if accounts is None:
+            return None
         acct_id = accounts['data'][0]['id']
         params = {"account-id": acct_id,
                   "amount": amount,
@@ -168,8 +265,10 @@ class Huobi(object):
         print(result.json())
         if result.status_code != 200 or result.json()["status"] == "error":
             return None
-        order_info = self._get_order_info(result.json()['data'])['data']
-        return HuobiOrder.create_object_from_json(order_info)
+        order_info = self._get_order_info(result.json()['data'])
+        if order_info is None:
+            return None
+        return self._track_order(HuobiOrder.create_object_from_json(order_info['data']), market)
 
     def move_order(self, order, rate, amount):
         is_closed = self.cancel_order(order)
@@ -181,6 +280,8 @@ class Huobi(object):
         return None
 
     def get_open_orders(self, pairs=None):
+        if pairs is None:
+            return self._get_all_open_orders()
         params = {'symbol': pairs,
                   'states': 'pre-submitted,submitted,partial-filled,partial-canceled'}
 
@@ -194,15 +295,32 @@ class Huobi(object):
             result.append(HuobiOrder.create_object_from_json(order))
         return result
 
-    def get_symbols(self):
-        path = '/v1/common/symbols'
-        symbols = self.api_key_get({}, path)
-        if symbols.status_code != 200:
+    def _get_all_open_orders(self, size=500):
+        # /v1/order/orders needs a symbol, openOrders lists every symbol of the account
+        accounts = self._get_accounts()
+        if accounts is None:
             return None
+        params = {'account-id': accounts['data'][0]['id'], 'size': size}
         result = []
-        for symbol in symbols.json()['data']:
-            result.append(symbol['base-currency'] + symbol['quote-currency'])
-        return result
+        while True:
+            data = self.api_key_get(dict(params), '/v1/order/openOrders')
+            if data.status_code != 200 or data.json()['status'] != 'ok':
+                print(data.json())
+                return None
+            orders = data.json()['data']
+            for order in orders:
+                order = dict(order, **{'field-cash-amount': order.get('filled-cash-amount', '0')})
+                result.append(HuobiOrder.create_object_from_json(order))
+            if len(orders) < size:
+                return result
+            params.update({'from': orders[-1]['id'], 'direct': 'next'})
+
+    @coalesce('METADATA_TTL')
+    def get_symbols(self):
+        symbols = self._get_common_symbols()
+        if symbols is None:
+            return None
+        return [symbol['base-currency'] + symbol['quote-currency'] for symbol in symbols]
 
     def cancel_order(self, order):
         params = {}
@@ -210,6 +328,8 @@ class Huobi(object):
         result = self.api_key_post(params, url)
         if result.status_code != 200:
             return False
+        if self.ledger is not None:
+            self.ledger.on_cancel(order)
         return True
 
     def close_order(self, order):
@@ -222,13 +342,17 @@ class Huobi(object):
         return False
 
     def get_full_balance(self):
-        balances = self.get_balance()
+        # Frozen rows are kept, so trade plus frozen per currency is the account total
+        balances = self.get_balance(frozen=True)
+        if balances is None:
+            return None
         result = []
         print(balances)
         for balance in balances:
             result.append(Balance(balance['currency'], balance['balance'], balance['type']))
         return result
 
+    @coalesce('METADATA_TTL')
     def _get_accounts(self):
         path = "/v1/account/accounts"
         result = self.api_key_get({}, path)
@@ -236,8 +360,10 @@ class Huobi(object):
             return None
         return result.json()
 
-    def get_balance(self):
+    def get_balance(self, frozen=False):
         accounts = self._get_accounts()
+        if accounts is None:
+            return None
         acct_id = accounts['data'][0]['id']
         url = "/v1/account/accounts/{0}/balance".format(acct_id)
         params = {"account-id": acct_id}
@@ -246,20 +372,69 @@ class Huobi(object):
             return None
         result = []
         for balance in data.json()['data']['list']:
-            if balance["type"] == "frozen":
+            if balance["type"] == "frozen" and not frozen:
                 continue
             if Decimal(balance['balance']) != Decimal(0):
                 result.append(balance)
         return result
 
+    @coalesce('MARKET_DATA_TTL')
     def get_tickers(self, currency=None):
         url = self.MARKET_URL + '/market/detail/merged'
         params = {'symbol': currency}
-        result = self.http_get_request(url, params)
+        result = self.http_get_request(url, params, hedge=True)
         if result.status_code != 200:
             return None
         return result.json()
 
+    @coalesce('MARKET_DATA_TTL')
+    def _get_all_tickers(self):
+        url = self.MARKET_URL + '/market/tickers'
+        result = self.http_get_request(url, {}, hedge=True)
+        if result.status_code != 200:
+            return []
+        return result.json()['data']
+
+    def get_all_tickers(self):
+        result = {}
+        for ticker in self._get_all_tickers():
+            result[ticker['symbol']] = {
+                'last': Decimal("{}".format(ticker['close'])),
+                'bid': Decimal("{}".format(ticker['bid'])),
+                'ask': Decimal("{}".format(ticker['ask'])),
+                'volume': Decimal("{}".format(ticker['amount'])),
+            }
+        return result
+
+    def get_best_bid_ask(self, symbols=None):
+        result = {}
+        for ticker in self._get_all_tickers():
+            if symbols is not None and ticker['symbol'] not in symbols:
+                continue
+            result[ticker['symbol']] = {
+                'bid': Decimal("{}".format(ticker['bid'])),
+                'bid_size': Decimal("{}".format(ticker['bidSize'])),
+                'ask': Decimal("{}".format(ticker['ask'])),
+                'ask_size': Decimal("{}".format(ticker['askSize'])),
+            }
+        return result
+
+    def get_depth(self, symbol, limit=20):
+        book = self.get_orderbook(symbol)
+        if not book or 'tick' not in book:
+            return None
+        return {
+            'bids': [(Decimal("{}".format(d[0])), Decimal("{}".format(d[1]))) for d in book['tick']['bids'][:limit]],
+            'asks': [(Decimal("{}".format(d[0])), Decimal("{}".format(d[1]))) for d in book['tick']['asks'][:limit]],
+        }
+
+    def get_orderbooks(self, symbols, max_concurrency=8):
+        result = {}
+        for symbol, book, error in self.for_symbols(self.get_depth, symbols, max_concurrency):
+            if error is None and book is not None:
+                result[symbol] = book
+        return result
+
     def get_all_usdt_balance(self):
         btc = self.get_all_btc_balance()
         price = Decimal(self.get_tickers(currency='btcusdt')['tick']['close'])
@@ -296,21 +471,129 @@ class Huobi(object):
             result.append(HuobiTrade.create_object_from_json(trade))
         return result
 
+    def get_fills(self, symbol, since_id=None, since_time=None, size=100):
+        path = '/v1/order/matchresults'
+        # Page forward from the last stored fill, or backward from the newest one on first sync
+        cursor = since_id
+        direct = 'next' if since_id is not None else 'prev'
+        result = []
+        while True:
+            params = {'symbol': symbol, 'size': size}
+            if cursor is not None:
+                params.update({'from': cursor, 'direct': direct})
+            data = self.api_key_get(params, path)
+            if data.status_code != 200 or data.json()['status'] != 'ok':
+                print(data.json())
+                return None
+            fills = data.json()['data']
+            for fill in fills:
+                result.append({
+                    'id': fill['id'], 'symbol': symbol, 'order_id': fill['order-id'],
+                    'side': fill['type'].split('-')[0], 'price': fill['price'],
+                    'amount': fill['filled-amount'], 'fee': fill['filled-fees'],
+                    'fee_asset': fill.get('fee-currency'), 'time': fill['created-at'],
+                })
+            if len(fills) < size:
+                return result
+            ids = [int(fill['id']) for fill in fills]
+            cursor = max(ids) if direct == 'next' else min(ids)
+
+    @coalesce('METADATA_TTL')
+    def get_symbol_assets(self):
+        symbols = self._get_common_symbols()
+        if symbols is None:
+            return None
+        assets = {}
+        for f in symbols:
+            assets[f['base-currency'] + f['quote-currency']] = (f['base-currency'], f['quote-currency'])
+        return assets
+
     def get_margin_position(self, pairs=None):
-        params = {'symbol': pairs,
-                  'states': 'pre-submitted,submitted,partial-filled,partial-canceled,canceled,filled'}
-        url = "/v1/order/orders"
+        params = {}
+        if pairs:
+            params['symbol'] = pairs
+        url = "/v1/margin/accounts/balance"
         data = self.api_key_get(params, url)
         if data.status_code != 200:
             return None
-        result = []
-        for position in data.json()['data']:
-            if position['source'] == 'margin-api':
-                result.append(position)
-        return result
+        assets = self.get_symbol_assets()
+        fills = []
+        symbols = []
+        for account in data.json()['data']:
+            symbol = account['symbol']
+            base, quote = assets[symbol]
+            symbols.append(symbol)
+            net = Decimal(0)
+            borrowed = None
+            for balance in account['list']:
+                if balance['currency'] == base and balance['type'] in ('trade', 'frozen', 'loan', 'interest'):
+                    net += Decimal(balance['balance'])
+                if balance['type'] == 'loan' and Decimal(balance['balance']) != 0:
+                    borrowed = balance['currency']
+            if borrowed is None or net == 0:
+                continue
+            cached = self.margin.get(symbol)
+            price = cached.base_price if cached is not None else None
+            fills.append((symbol, 'long' if net > 0 else 'short', abs(net), price))
+        self.margin.load(fills, symbols if pairs else None)
+        return [p for p in self.margin.positions() if p.symbol in symbols]
+
+    def _get_cached_position(self, symbol):
+        if not self.margin.loaded:
+            self.get_margin_position()
+        return self.margin.get(symbol)
+
+    def _margin_order(self, symbol, order_type, amount, rate=None):
+        params = {"account-id": self._get_margin_account(symbol),
+                  "amount": amount,
+                  "symbol": symbol,
+                  "source": 'margin-api'}
+        if rate is None:
+            book = self.get_depth(symbol, limit=1)
+            if book is None:
+                return None
+            price = book['asks'][0][0] if order_type == 'buy' else book['bids'][0][0]
+            params['type'] = 'buy-market' if order_type == 'buy' else 'sell-market'
+            if order_type == 'buy':
+                params['amount'] = Decimal(amount) * price
+        else:
+            params['price'] = rate
+            params['type'] = 'buy-ioc' if order_type == 'buy' else 'sell-ioc'
+
+        url = '/v1/order/orders/place'
+        result = self.api_key_post(params, url)
+        if result.status_code != 200 or result.json()['status'] == 'error':
+            print(result.json())
+            return None
+        order_id = result.json()['data']
+        if rate is None:
+            self.margin.apply_fill(symbol, order_type, amount, price)
+        else:
+            self._margin_orders[str(order_id)] = (symbol, order_type, amount, rate)
+        return order_id
+
+    def repay_margin_loans(self, symbol):
+        params = {'symbol': symbol, 'states': 'accrual'}
+        data = self.api_key_get(params, '/v1/margin/loan-orders')
+        if data.status_code != 200:
+            return False
+        repaid = True
+        for loan in data.json()['data']:
+            amount = Decimal(loan['loan-balance']) + Decimal(loan['interest-balance'])
+            url = '/v1/margin/orders/{0}/repay'.format(loan['id'])
+            result = self.api_key_post({'amount': amount}, url)
+            if result.status_code != 200 or result.json()['status'] == 'error':
+                print(result.json())
+                repaid = False
+        return repaid
 
     def close_margin_position(self, symbol):
-        pass
+        p = self._get_cached_position(symbol)
+        if p is None:
+            return None
+        if self._margin_order(symbol, 'sell' if p.side == 'long' else 'buy', p.amount) is None:
+            return False
+        return self.repay_margin_loans(symbol)
 
     def get_margin_info(self):
         url = "/v1/margin/accounts/balance"
@@ -320,36 +603,78 @@ class Huobi(object):
         return HuobiMarginInfo.create_object_from_json(data.json())
 
     def _get_margin_account(self, symbol):
-        accounts = self._get_accounts()['data']
-        for acc in accounts:
+        accounts = self._get_accounts()
+        if accounts is None:
+            return None
+        for acc in accounts['data']:
             if acc['type'] == 'margin' and acc['subtype'] == symbol:
                 return acc['id']
 
     # {'status': 'ok', 'data': '4976368728'}
     def open_margin_position(self, symbol, rate, amount, side):
-        acct_id = self._get_margin_account(symbol)
-        params = {"account-id": acct_id,
-                  "amount": amount,
-                  "symbol": symbol,
-                  "price": rate,
-                  "type": 'sell-ioc' if int(side) == 0 else 'buy-ioc',
-                  "source": 'margin-api'}
+        order_id = self._margin_order(symbol, 'sell' if int(side) == 0 else 'buy', amount, rate)
+        if order_id is None:
+            return None
+        return {'status': 'ok', 'data': order_id}
 
-        url = '/v1/order/orders/place'
-        result = self.api_key_post(params, url)
-        if result.status_code != 200:
+    def borrow_margin(self, symbol, currency, amount):
+        params = {'symbol': symbol, 'currency': currency, 'amount': amount}
+        result = self.api_key_post(params, '/v1/margin/orders')
+        if result.status_code != 200 or result.json()['status'] == 'error':
+            print(result.json())
             return None
-        return result.json()
+        return result.json()['data']
 
     def toggle_margin_positions(self, margin_position):
-        pass
+        # Isolated margin accounts do not net opposite orders: the position is closed and its
+        # loan repaid, then the asset for the reverse side is borrowed and the new position opened
+        p = self._get_cached_position(margin_position.symbol) or margin_position
+        amount = Decimal(p.amount)
+        if not self.close_margin_position(p.symbol):
+            return None
+        base, quote = self.get_symbol_assets()[p.symbol]
+        if p.side == 'long':
+            order_type = 'sell'
+            loan = self.borrow_margin(p.symbol, base, amount)
+        else:
+            order_type = 'buy'
+            book = self.get_depth(p.symbol, limit=1)
+            if book is None:
+                return None
+            loan = self.borrow_margin(p.symbol, quote, amount * book['asks'][0][0])
+        if loan is None:
+            print("Huobi {} position closed, borrowing for the reverse side failed".format(p.symbol))
+            return None
+        if self._margin_order(p.symbol, order_type, amount) is None:
+            print("Huobi {} position closed, reverse order failed with loan {} outstanding".format(p.symbol, loan))
+            return None
+        return self.margin.positions()
 
     def is_order_fulfilled(self, order):
-        data = self._get_order_info(order.number)['data']
+        data = self._get_order_info(order.number)
+        if data is None:
+            return False
+        data = data['data']
+        if data['state'] in ('filled', 'partial-canceled', 'canceled'):
+            pending = self._margin_orders.pop(str(order.number), None)
+        else:
+            pending = None
+        if pending is not None:
+            symbol, order_type, amount, rate = pending
+            self.margin.apply_fill(symbol, order_type, Decimal(data['field-amount']), rate)
         if data['state'] == 'filled':
+            if self.ledger is not None:
+                self.ledger.on_fill(order)
             return True
         return False
 
+    def get_execution(self, order, symbol=None):
+        data = self._get_order_info(order.number)
+        if data is None:
+            return None
+        data = data['data']
+        return {'amount': Decimal(data['field-amount']), 'notional': Decimal(data['field-cash-amount'])}
+
 
 class HuobiTrade(Trade):
 
@@ -0,0 +1,140 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from .base import Balance
+
+# Per-key calls may fan out on the shared pool themselves, so they are not queued on it
+_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='keypool')
+
+
+class ClientPool(object):
+
+    def __init__(self, client_cls, auths, strategy='round_robin', **kwargs):
+        if strategy not in ('round_robin', 'least_loaded'):
+            raise ValueError("Unknown strategy {}".format(strategy))
+        self.clients = [client_cls(auth, **kwargs) for auth in auths]
+        self.strategy = strategy
+        self._inflight = [0] * len(self.clients)
+        self._counter = itertools.count()
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def _pick(self):
+        if self.strategy == 'least_loaded':
+            with self._lock:
+                return min(range(len(self.clients)), key=lambda i: self._inflight[i])
+        return next(self._counter) % len(self.clients)
+
+    def _call(self, i, name, *args, **kwargs):
+        with self._lock:
+            self._inflight[i] += 1
+        try:
+            return getattr(self.clients[i], name)(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._inflight[i] -= 1
+
+    def _all(self, name, *args, **kwargs):
+        # Aggregates are all or nothing: a key that failed would make a total look smaller than it is
+        futures = [_pool.submit(self._call, i, name, *args, **kwargs) for i in range(len(self.clients))]
+        results = []
+        for i, future in enumerate(futures):
+            error = future.exception()
+            result = future.result() if error is None else None
+            if result is None:
+                print("{} failed for key {} of {}: {}".format(name, i, len(self.clients), error))
+                return None
+            results.append(result)
+        return results
+
+    def _remember(self, i, order):
+        if order is not None:
+            with self._lock:
+                self._owners[str(order.number)] = i
+        return order
+
+    def _owner(self, order):
+        number = str(order.number)
+        if number not in self._owners:
+            # Orders placed before the pool existed: learn owners from the open orders of every key
+            self.get_open_orders()
+        return self._owners.get(number)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if not callable(getattr(self.clients[0], name)):
+            return getattr(self.clients[0], name)
+
+        def call(*args, **kwargs):
+            return self._call(self._pick(), name, *args, **kwargs)
+        return call
+
+    def new_order(self, rate, order_type, amount, symbol, market=False):
+        i = self._pick()
+        return self._remember(i, self._call(i, 'new_order', rate, order_type, amount, symbol, market=market))
+
+    def cancel_order(self, order):
+        i = self._owner(order)
+        if i is None:
+            return False
+        result = self._call(i, 'cancel_order', order)
+        if result:
+            with self._lock:
+                self._owners.pop(str(order.number), None)
+        return result
+
+    def close_order(self, order):
+        i = self._owner(order)
+        if i is None:
+            return False
+        return self._call(i, 'close_order', order)
+
+    def move_order(self, order, rate, amount):
+        i = self._owner(order)
+        if i is None:
+            return None
+        number = self._call(i, 'move_order', order, rate, amount)
+        if number:
+            with self._lock:
+                self._owners[str(number)] = i
+        return number
+
+    def is_order_fulfilled(self, order):
+        i = self._owner(order)
+        if i is None:
+            return False
+        return self._call(i, 'is_order_fulfilled', order)
+
+    def get_open_orders(self, *args, **kwargs):
+        results = self._all('get_open_orders', *args, **kwargs)
+        if results is None:
+            return None
+        result = []
+        for i, orders in enumerate(results):
+            for order in orders:
+                self._remember(i, order)
+                result.append(order)
+        return result
+
+    def get_trade_history(self, *args, **kwargs):
+        results = self._all('get_trade_history', *args, **kwargs)
+        if results is None:
+            return None
+        result = []
+        for trades in results:
+            result.extend(trades)
+        return result
+
+    def get_full_balance(self):
+        results = self._all('get_full_balance')
+        if results is None:
+            return None
+        totals = {}
+        for balances in results:
+            for balance in balances:
+                key = (balance.currency, balance.type)
+                totals[key] = totals.get(key, Decimal(0)) + Decimal(balance.amount)
+        return [Balance(currency, amount, type) for (currency, type), amount in totals.items()]
@@ -1,21 +1,40 @@
 import hmac
 import hashlib
-import requests
+import threading
 import time
 import base64
 from urllib.parse import urlencode
 from decimal import Decimal
 from .base import Balance, Order, Trade, MarginInfo, MarginPosition
+from .fanout import for_symbols
+from .singleflight import coalesce, coalescing_stats
+from .margin import MarginBook
+from .transport import default_transport
+from .resilience import Resilience
+from .ledger import BalanceLedger
+from .candles import Candles, INTERVALS
 from datetime import datetime
 
 
 class Kraken(object):
     GET_URL = 'https://api.kraken.com/0/public/{}'
     POST_URL = 'https://api.kraken.com/0/private/{}'
+    RATE_LIMIT = 1
+    MARKET_DATA_TTL = 0.05
+    METADATA_TTL = 60
+    ORDER_METHODS = ('AddOrder', 'CancelOrder')
 
-    def __init__(self, auth):
+    def __init__(self, auth, cache=None, resilience=None, transport=None):
         self._secret = auth.get_secret()
         self._key = auth.get_key()
+        self._cache = cache
+        self._resilience = resilience or Resilience()
+        self._transport = transport or default_transport()
+        self.ledger = None
+        self.margin = MarginBook()
+        self._margin_orders = {}
+        self._last_nonce = 0
+        self._nonce_lock = threading.Lock()
 
     def sign_request(self, method, data):
         urlpath = "/0/private/{}".format(method)
@@ -35,32 +54,69 @@ class Kraken(object):
         return headers
 
     def _nonce(self):
-        return int(1000 * time.time())
+        # Threads calling in the same millisecond still get strictly increasing nonces
+        with self._nonce_lock:
+            self._last_nonce = max(self._last_nonce + 1, int(1000 * time.time()))
+            return self._last_nonce
+
+    def _send(self, method, send, idempotent, hedge=False):
+        try:
+            result = self._resilience.call(method, send, idempotent=idempotent, hedge=hedge).json()
+        except Exception as e:
+            return {'error': [str(e)]}
+        if 'error' not in result:
+            return {'error': ['EGeneral:Unexpected response']}
+        if not result['error'] and 'result' not in result:
+            return {'error': ['EGeneral:Missing result']}
+        return result
+
+    def _public(self, method, params=None):
+        def send(timeout):
+            return self._transport.request('GET', self.GET_URL.format(method), params=params, timeout=timeout)
+        return self._send(method, send, idempotent=True, hedge=True)
+
+    def _private(self, method, data=None):
+        def send(timeout):
+            # A fresh nonce and signature per attempt, Kraken rejects a reused nonce
+            payload = dict(data or {}, nonce=self._nonce())
+            headers = self.get_req_headers(method, payload)
+            return self._transport.request('POST', self.POST_URL.format(method), data=payload,
+                                           headers=headers, timeout=timeout)
+        return self._send(method, send, idempotent=method not in self.ORDER_METHODS)
+
+    def _track_order(self, order, market=False):
+        if self.ledger is not None and order is not None:
+            if market:
+                self.ledger.on_market_fill(order)
+            else:
+                self.ledger.on_order_placed(order)
+        return order
+
+    def coalescing_stats(self):
+        return coalescing_stats(self)
+
+    def for_symbols(self, method, symbols, max_concurrency=8, key=None, **kwargs):
+        return for_symbols(self, method, symbols, max_concurrency, key, **kwargs)
 
     def get_balance(self):
-        orders = self.get_open_orders()
-        balances = self.get_full_balance()
+        ledger = self.ledger or BalanceLedger(self).seed()
         result = []
-        for order in orders:
-            for balance in balances:
-                if order.type == 'sell':
-                    symbol = order.symbol[:3]
-                else:
-                    symbol = order.symbol[3:]
-                if balance.currency.find(symbol) != -1:
-                    freeze = order.amount * order.rate
-                    result.append({symbol: {'freeze': freeze, 'free': Decimal(balance.amount) - freeze}})
+        for asset, balance in ledger.balances().items():
+            if balance['locked'] != 0:
+                result.append({asset: {'freeze': balance['locked'], 'free': balance['free']}})
         return result
 
+    def _asset_name(self, code):
+        # Legacy Kraken asset codes carry an X/Z class prefix: XXBT, ZUSD
+        if len(code) == 4 and code[0] in 'XZ':
+            return code[1:]
+        return code.upper()
+
     def _get_all_balance(self, symbol):
-        method = 'TradeBalance'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce(),
-            'asset': symbol,
-        }
-        headers = self.get_req_headers(method, data)
-        data = requests.post(url, data=data, headers=headers).json()
+        data = self._private('TradeBalance', {'asset': symbol})
+        if data['error']:
+            print(data['error'])
+            return None
         return data['result']['eb']
 
     def apply_fee(self, order):
@@ -77,41 +133,50 @@ class Kraken(object):
         return self._get_all_balance('XBT')
 
     def get_full_balance(self):
-        method = 'Balance'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce(),
-        }
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers).json()
+        result = self._private('Balance')
 
-        print(result)
-        if "error" in result and len(result["error"]) > 0:
-            return []
+        if result['error']:
+            print(result['error'])
+            return None
         res = []
         for cur, vol in result['result'].items():
             if Decimal(vol) == Decimal(0):
                 continue
-            res.append(Balance(cur[1:].upper(), vol, type='exchange'))
+            res.append(Balance(self._asset_name(cur), vol, type='exchange'))
         return res
 
-    def get_orderbook(self, symbol):
-        method = 'Depth'
+    @coalesce('MARKET_DATA_TTL')
+    def get_orderbook(self, symbol, count=1):
         params = {
-            'nonce': self._nonce(),
             'pair': symbol,
-            'count': 1,
+            'count': count,
         }
-        url = self.GET_URL.format(method)
-        data = requests.get(url, params=params).json()
+        data = self._public('Depth', params)
         if data['error']:
             return data['error']
         else:
-            return data['result'][symbol]
+            # The book is keyed by Kraken's pair name (XXBTZUSD) whatever spelling was requested
+            return next(iter(data['result'].values()), None)
+
+    def get_depth(self, symbol, limit=20):
+        book = self.get_orderbook(symbol, count=limit)
+        if not isinstance(book, dict):
+            return None
+        return {
+            'bids': [(Decimal(d[0]), Decimal(d[1])) for d in book['bids']],
+            'asks': [(Decimal(d[0]), Decimal(d[1])) for d in book['asks']],
+        }
+
+    def get_orderbooks(self, symbols, max_concurrency=8):
+        result = {}
+        for symbol, book, error in self.for_symbols(self.get_depth, symbols, max_concurrency):
+            if error is None and book is not None:
+                result[symbol] = book
+        return result
 
     def get_last_price(self, symbol, action, amount):
         glass = self.get_orderbook(symbol)
-        if glass:
+        if isinstance(glass, dict):
             data = glass['asks'] if action == "buy" else glass['bids']
             for d in data:
                 amount -= float(d[1])
@@ -120,78 +185,170 @@ class Kraken(object):
         else:
             return None
 
-    def get_symbols(self):
-        method = 'AssetPairs'
-        url = self.GET_URL.format(method)
-        params = {
-            'nonce': self._nonce()
-        }
-        data = requests.get(url, params=params).json()
-        result = []
+    def get_klines(self, symbol, interval, start, end=None):
+        # OHLC only serves the latest 720 bars, older history is not available
+        end = end or int(time.time() * 1000)
+        result = Candles(interval)
+        params = {'pair': symbol, 'interval': INTERVALS[interval] // 60, 'since': start // 1000 - 1}
+        while True:
+            data = self._public('OHLC', params)
+            if data['error']:
+                print(data['error'])
+                return None
+            last = data['result'].pop('last')
+            rows = next(iter(data['result'].values()), [])
+            count = len(result)
+            for k in rows:
+                t = int(k[0]) * 1000
+                if start <= t < end:
+                    result.append(t, k[1], k[2], k[3], k[4], k[6])
+            if len(result) == count or last * 1000 >= end or last <= params['since']:
+                return result
+            params['since'] = last
+
+    @coalesce('METADATA_TTL')
+    def _get_asset_pairs(self):
+        # One AssetPairs download feeds the symbol, asset, pair name and filter views
+        if self._cache is not None:
+            return self._cache.get('Kraken', 'asset_pairs', self._fetch_asset_pairs)
+        return self._fetch_asset_pairs()
+
+    def _fetch_asset_pairs(self):
+        data = self._public('AssetPairs')
         if data['error']:
-            return data['error']
-        else:
-            print(data['result'])
-            for key in data['result'].keys():
-                result.append(data['result'][key]['altname'])
-            return result
+            print(data['error'])
+            return None
+        return data['result']
 
-    def get_filters(self):
-        method = 'AssetPairs'
-        url = self.GET_URL.format(method)
-        params = {
-            'nonce': self._nonce()
-        }
-        data = requests.get(url, params=params).json()
+    @coalesce('METADATA_TTL')
+    def get_symbols(self):
+        pairs = self._get_asset_pairs()
+        if pairs is None:
+            return None
+        return [pair['altname'] for pair in pairs.values()]
 
-        result = []
-        print(data)
-        if data['error']:
-            print(data["error"])
+    @coalesce('METADATA_TTL')
+    def get_symbol_assets(self):
+        pairs = self._get_asset_pairs()
+        if pairs is None:
             return None
-        else:
-            for d in data["result"]:
-                result.append({
-                    "min_price": 0.00000001,
-                    "min_amount": 0.00000001, # 1/10**data["result"][d]["pair_decimals"],
-                    "min_lot": 1/10**data["result"][d]["lot_decimals"],
-                    "pairs": d,
-                    "exchange": "Kraken"
-                })
-            return result
+        result = {}
+        for key, pair in pairs.items():
+            assets = (self._asset_name(pair['base']), self._asset_name(pair['quote']))
+            result[key] = assets
+            result[pair['altname']] = assets
+        return result
+
+    @coalesce('METADATA_TTL')
+    def get_pair_names(self):
+        pairs = self._get_asset_pairs()
+        if pairs is None:
+            return None
+        result = {}
+        for key, pair in pairs.items():
+            result[key] = pair['altname']
+            result[pair['altname']] = pair['altname']
+        return result
 
+    def _rekey(self, data, symbols=None):
+        # Kraken answers with its own pair keys (XXBTZUSD), callers look results up by the symbol they passed
+        names = self.get_pair_names() or {}
+        requested = dict((names.get(s, s), s) for s in symbols or [])
+        result = {}
+        for key, value in data.items():
+            altname = names.get(key, key)
+            result[requested.get(altname, altname)] = value
+        return result
+
+    @coalesce('METADATA_TTL')
+    def get_filters(self):
+        pairs = self._get_asset_pairs()
+        if pairs is None:
+            return None
+        result = []
+        for d in pairs:
+            result.append({
+                "min_price": 0.00000001,
+                "min_amount": 0.00000001, # 1/10**pairs[d]["pair_decimals"],
+                "min_lot": 1/10**pairs[d]["lot_decimals"],
+                "pairs": d,
+                "exchange": "Kraken"
+            })
+        return result
+
+    @coalesce('MARKET_DATA_TTL')
     def get_tickers(self, currency=None):
-        method = 'Ticker'
-        url = self.GET_URL.format(method)
-        params = {
-            'nonce': self._nonce(),
-        }
+        params = {}
         if currency is not None:
             params.update({'pair': currency})
         else:
-            params.update({'pair': ', '.join(self.get_symbols())})
+            params.update({'pair': ', '.join(self.get_symbols() or [])})
 
-        data = requests.get(url, params=params).json()
-        return data
+        return self._public('Ticker', params)
 
-    def get_feeinfo(self):
-        '''method = 'AssetPairs'
-        url = self.GET_URL.format(method)
-        params = {
-            'nonce': self._nonce(),
-        }
-        data = requests.get(url, params=params).json()
-        return data['result']'''
+    @coalesce('MARKET_DATA_TTL')
+    def _get_all_tickers(self, symbols=None):
+        params = {}
+        if symbols:
+            params['pair'] = ','.join(symbols)
+        data = self._public('Ticker', params)
+        if data['error']:
+            print(data['error'])
+            return {}
+        return data['result']
+
+    def get_all_tickers(self):
+        result = {}
+        for symbol, ticker in self._rekey(self._get_all_tickers()).items():
+            result[symbol] = {
+                'last': Decimal(ticker['c'][0]),
+                'bid': Decimal(ticker['b'][0]),
+                'ask': Decimal(ticker['a'][0]),
+                'volume': Decimal(ticker['v'][1]),
+            }
+        return result
+
+    def get_best_bid_ask(self, symbols=None):
+        result = {}
+        for symbol, ticker in self._rekey(self._get_all_tickers(symbols), symbols).items():
+            result[symbol] = {
+                'bid': Decimal(ticker['b'][0]),
+                'bid_size': Decimal(ticker['b'][2]),
+                'ask': Decimal(ticker['a'][0]),
+                'ask_size': Decimal(ticker['a'][2]),
+            }
+        return result
 
-        # Для каждой пары возвращает комиссию отдельно. Временное решение
+    def get_feeinfo(self, symbol=None):
+        if symbol is not None:
+            fees = self.get_fee_schedule([symbol])
+            return next(iter(fees.values()), None)
+        # Для каждой пары возвращает комиссию отдельно, см. get_fee_schedule
         return {'maker_fee': Decimal(0.16) / Decimal(100),
                 'taker_fee': Decimal(0.26) / Decimal(100)}
 
+    def get_fee_schedule(self, symbols=None):
+        symbols = symbols or self.get_symbols() or []
+        data = self._private('TradeVolume', {'pair': ','.join(symbols), 'fee-info': 'true'})
+        result = {}
+        if data['error']:
+            print(data['error'])
+            return result
+        volume = Decimal(data['result']['volume'])
+        makers = data['result'].get('fees_maker', {})
+        for pair, taker in data['result'].get('fees', {}).items():
+            maker = makers.get(pair, taker)
+            result[pair] = {
+                'maker_fee': Decimal(maker['fee']) / 100,
+                'taker_fee': Decimal(taker['fee']) / 100,
+                'volume': volume,
+                'next_volume': Decimal(taker['nextvolume']) if taker.get('nextvolume') else None,
+                'next_taker_fee': Decimal(taker['nextfee']) / 100 if taker.get('nextfee') else None,
+            }
+        return self._rekey(result, symbols)
+
     def new_order(self, rate, order_type, amount, symbol, market=False):
-        method = 'AddOrder'
-        url = self.POST_URL.format(method)
         data = {
-            'nonce': self._nonce(),
             'pair': symbol,
             'type': 'buy' if order_type == 'buy' else 'sell',
 
@@ -202,10 +359,7 @@ class Kraken(object):
             data.update({'ordertype': 'limit', 'price': float(rate), 'volume': float(amount)})
 
         print(data)
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers)
-        print(result.status_code, result.content)
-        result = result.json()
+        result = self._private('AddOrder', data)
         if result['error']:
             print(result)
             return None
@@ -213,17 +367,14 @@ class Kraken(object):
             print(result['result']['txid'][0])
             order = {'orderId': result['result']['txid'][0], 'rate': rate, 'type': order_type,
                      'amount': amount, 'symbol': symbol}
-            return KrakenOrder.create_object_from_json(order)
+            return self._track_order(KrakenOrder.create_object_from_json(order), market)
 
     def get_open_orders(self):
-        method = 'OpenOrders'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce()
-        }
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers).json()
+        result = self._private('OpenOrders')
         res = []
+        if result['error']:
+            print(result['error'])
+            return None
         for key in result['result']['open'].keys():
             order_info = result['result']['open'][key]
             order = {'orderId': key, 'rate': order_info['descr']['price'], 'type': order_info['descr']['type'],
@@ -232,63 +383,80 @@ class Kraken(object):
         return res
 
     def cancel_order(self, order):
-        method = 'CancelOrder'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce(),
-            'txid': order.number,
-        }
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers).json()
+        result = self._private('CancelOrder', {'txid': order.number})
         if result['error']:
             return False
+        if self.ledger is not None:
+            self.ledger.on_cancel(order)
         return True
 
     def close_order(self, order):
-        method = 'AddOrder'
-        url = self.POST_URL.format(method)
         is_closed = self.cancel_order(order)
         if not is_closed:
             return False
 
         data = {
-            'nonce': self._nonce(),
             'pair': order.symbol.name,
             'type': order.order_type,
             'ordertype': 'market',
             'volume': order.amount
         }
 
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers).json()
+        result = self._private('AddOrder', data)
         print(result)
         if not result['error']:
             return True
         return False
 
     def get_trade_history(self, start=None, end=None, limit=1000, pairs=None):
-        method = 'TradesHistory'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce(),
-        }
-        headers = self.get_req_headers(method, data)
-        data = requests.post(url, data=data, headers=headers).json()
-        print(data)
+        data = self._private('TradesHistory')
         result = []
+        if data['error']:
+            print(data['error'])
+            return result
         for key in data['result']['trades'].keys():
             result.append(KrakenTrade.create_object_from_json(data['result']['trades'][key]))
         return result
 
+    def get_fills(self, symbol, since_id=None, since_time=None):
+        fills = self.get_fills_by_symbol([symbol], since_time)
+        return fills[symbol] if fills is not None else None
+
+    def get_fills_by_symbol(self, symbols, since_time=None):
+        # TradesHistory is account wide and can't filter by pair: page it once and split rows by symbol
+        names = self.get_pair_names() or {}
+        requested = dict((names.get(s, s), s) for s in symbols)
+        data = {}
+        if since_time is not None:
+            data['start'] = since_time / 1000.0
+        result = dict((s, []) for s in symbols)
+        offset = 0
+        while True:
+            page = self._private('TradesHistory', dict(data, ofs=offset))
+            if page['error']:
+                print(page['error'])
+                return None
+            trades = page['result']['trades']
+            for key, trade in trades.items():
+                symbol = requested.get(names.get(trade['pair'], trade['pair']))
+                if symbol is None:
+                    continue
+                result[symbol].append({
+                    'id': key, 'symbol': symbol, 'order_id': trade['ordertxid'],
+                    'side': trade['type'], 'price': trade['price'], 'amount': trade['vol'],
+                    'fee': trade['fee'], 'fee_asset': None,
+                    'time': int(float(trade['time']) * 1000),
+                })
+            offset += len(trades)
+            if not trades or offset >= page['result']['count']:
+                return result
+
     def move_order(self, order, rate, amount):
         is_canceled = self.cancel_order(order)
         if not is_canceled:
             return None
 
-        method = 'AddOrder'
-        url = self.POST_URL.format(method)
         data = {
-            'nonce': self._nonce(),
             'pair': order.symbol.name,
             'type': order.order_type,
             'ordertype': 'limit',
@@ -296,107 +464,115 @@ class Kraken(object):
             'volume': amount,
 
         }
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers).json()
-        print(result)
-        if not result['error']:
-            try:
-                return result['result']['txid'][0]
-            except:
-                print("Fuck cant move order, kraken {}".format(order.number))
-        return None
+        result = self._private('AddOrder', data)
+        if result['error']:
+            print("Can't move order {} on Kraken: {}".format(order.number, result['error']))
+            return None
+        return result['result']['txid'][0]
 
     def get_margin_position(self):
-        method = 'OpenPositions'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce(),
-            'docalcs': 'true',
-        }
-        headers = self.get_req_headers(method, data)
-        positions = requests.post(url, data=data, headers=headers).json()
+        positions = self._private('OpenPositions', {'docalcs': 'true'})
+        if positions['error']:
+            print(positions['error'])
+            return None
         result = []
+        fills = []
         for key in positions['result'].keys():
-            result.append(KrakenMarginPosition.create_object_from_json(positions['result'][key]))
+            # Positions come keyed by Kraken's pair name, callers and the margin book use altnames
+            position = dict(positions['result'][key])
+            position['pair'] = self._altname(position['pair'])
+            result.append(KrakenMarginPosition.create_object_from_json(position))
+            amount = Decimal(position['vol']) - Decimal(position['vol_closed'])
+            fills.append((position['pair'], 'short' if position['type'] == 'sell' else 'long',
+                          amount, Decimal(position['cost']) / Decimal(position['vol'])))
+        self.margin.load(fills)
         return result
 
-    def close_margin_position(self, symbol):
-        positions = self.get_margin_position()
-        for p in positions:
-            if p.symbol == symbol:
-                method = 'AddOrder'
-                url = self.POST_URL.format(method)
-                data = {
-                    'nonce': self._nonce(),
-                    'pair': symbol,
-                    'type': 'sell' if p.side == 'long' else 'buy',
-                    'leverage': 2,
-                    'ordertype': 'market',
-                    'volume': p.amount,
-                }
-                headers = self.get_req_headers(method, data)
-                result = requests.post(url, data=data, headers=headers).json()
-                if not result['error']:
-                    return True
-                else:
-                    return False
+    def _altname(self, symbol):
+        return (self.get_pair_names() or {}).get(symbol, symbol)
 
-    def get_margin_info(self):
-        method = 'TradeBalance'
-        url = self.POST_URL.format(method)
+    def _get_cached_position(self, symbol):
+        if not self.margin.loaded:
+            self.get_margin_position()
+        return self.margin.get(self._altname(symbol))
+
+    def _margin_order(self, symbol, order_type, amount, rate=None):
+        symbol = self._altname(symbol)
         data = {
-            'nonce': self._nonce(),
+            'pair': symbol,
+            'type': order_type,
+            'leverage': 2,
+            'volume': amount,
         }
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers).json()
+        if rate is None:
+            # Market fills are booked at the top of book, the reversed side of a toggle needs a real entry price
+            book = self.get_depth(symbol, limit=1)
+            if book is None:
+                return None
+            price = book['asks'][0][0] if order_type == 'buy' else book['bids'][0][0]
+            data['ordertype'] = 'market'
+        else:
+            data.update({'ordertype': 'limit', 'price': rate})
+        result = self._private('AddOrder', data)
         if result['error']:
+            print(result['error'])
             return None
+        txid = result['result']['txid'][0]
+        if rate is None:
+            self.margin.apply_fill(symbol, order_type, amount, price)
         else:
-            return KrakenMarginInfo.create_object_from_json(result['result'])
+            self._margin_orders[txid] = (symbol, order_type, amount, rate)
+        return txid
 
-    def open_margin_position(self, symbol, rate, amount, side):
-        method = 'AddOrder'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce(),
-            'pair': symbol,
-            'type': 'sell' if int(side) == 0 else 'buy',
-            'ordertype': 'limit',
-            'price': rate,
-            'volume': amount,
-            'leverage': 2,
+    def close_margin_position(self, symbol):
+        p = self._get_cached_position(symbol)
+        if p is None:
+            return None
+        return self._margin_order(symbol, 'sell' if p.side == 'long' else 'buy', p.amount) is not None
 
-        }
-        headers = self.get_req_headers(method, data)
-        result = requests.post(url, data=data, headers=headers).json()
-        if not result['error']:
-            return self.get_margin_position()
+    def get_margin_info(self):
+        result = self._private('TradeBalance')
+        if result['error']:
+            return None
         else:
-            print(result['error'])
+            return KrakenMarginInfo.create_object_from_json(result['result'])
+
+    def open_margin_position(self, symbol, rate, amount, side):
+        txid = self._margin_order(symbol, 'sell' if int(side) == 0 else 'buy', amount, rate)
+        if txid is None:
             return None
+        return self.margin.positions()
 
     def toggle_margin_positions(self, margin_position):
-        self.close_margin_position(margin_position.symbol)
-        side = 0 if margin_position.side == 'long' else 1
-        return self.open_margin_position(
-            margin_position.symbol, margin_position.base_price,
-            margin_position.amount, side
-        )
+        # Kraken nets an opposite leveraged order against the open position first,
+        # so twice the volume closes the position and opens the reverse one
+        p = self._get_cached_position(margin_position.symbol) or margin_position
+        order_type = 'sell' if p.side == 'long' else 'buy'
+        txid = self._margin_order(p.symbol, order_type, Decimal(p.amount) * 2)
+        if txid is None:
+            return None
+        return self.margin.positions()
 
     def is_order_fulfilled(self, order):
-        method = 'QueryOrders'
-        url = self.POST_URL.format(method)
-        data = {
-            'nonce': self._nonce(),
-            'txid': order.number,
-        }
-        headers = self.get_req_headers(method, data)
-        res = requests.post(url, data=data, headers=headers).json()
+        res = self._private('QueryOrders', {'txid': order.number})
         if not res['error'] and res['result'][order.number]['vol'] == res['result'][order.number]['vol_exec']:
+            pending = self._margin_orders.pop(order.number, None)
+            if pending is not None:
+                self.margin.apply_fill(*pending)
+            if self.ledger is not None:
+                self.ledger.on_fill(order)
             return True
         else:
             return False
 
+    def get_execution(self, order, symbol=None):
+        res = self._private('QueryOrders', {'txid': order.number})
+        if res['error']:
+            print(res['error'])
+            return None
+        info = res['result'][order.number]
+        return {'amount': Decimal(info['vol_exec']), 'notional': Decimal(info['cost'])}
+
 
 class KrakenTrade(Trade):
 
@@ -0,0 +1,154 @@
+import threading
+from decimal import Decimal
+
+
+def _symbol_name(symbol):
+    return getattr(symbol, 'name', symbol)
+
+
+def _side(order_type):
+    # Huobi order types carry the order kind: buy-limit, sell-market
+    return order_type.split('-')[0]
+
+
+class BalanceLedger(object):
+
+    def __init__(self, client):
+        self.client = client
+        self._assets = {}
+        self._total = {}
+        self._locked = {}
+        self._orders = {}
+        self._lock = threading.RLock()
+        self._reconciler = None
+        self._stop = threading.Event()
+
+    def _split(self, symbol):
+        if not self._assets:
+            self._assets = self.client.get_symbol_assets() or {}
+        return self._assets.get(_symbol_name(symbol))
+
+    def seed(self):
+        balances = self.client.get_full_balance() or []
+        orders = self.client.get_open_orders() or []
+        with self._lock:
+            self._total = {}
+            self._locked = {}
+            self._orders = {}
+            for order in orders:
+                self._reserve(order)
+            # Balances are account totals: Huobi lists trade and frozen rows, which add up
+            for balance in balances:
+                amount = Decimal(balance.amount)
+                self._total[balance.currency] = self._total.get(balance.currency, Decimal(0)) + amount
+        return self
+
+    def _reserve(self, order):
+        assets = self._split(order.symbol)
+        if assets is None:
+            return
+        base, quote = assets
+        amount, rate = Decimal(order.amount), Decimal(order.rate)
+        side = _side(order.order_type)
+        if side == 'buy':
+            asset, locked = quote, amount * rate
+        else:
+            asset, locked = base, amount
+        self._locked[asset] = self._locked.get(asset, Decimal(0)) + locked
+        self._orders[str(order.number)] = [asset, locked, base, quote, side, amount, rate]
+
+    def on_order_placed(self, order):
+        with self._lock:
+            self._reserve(order)
+
+    def on_cancel(self, order):
+        with self._lock:
+            entry = self._orders.pop(str(getattr(order, 'number', order)), None)
+            if entry is not None:
+                self._locked[entry[0]] -= entry[1]
+
+    def on_fill(self, order, amount=None, price=None, fee=0):
+        with self._lock:
+            key = str(getattr(order, 'number', order))
+            entry = self._orders.get(key)
+            if entry is None:
+                return
+            asset, locked, base, quote, order_type, remaining, rate = entry
+            amount = remaining if amount is None else min(Decimal(amount), remaining)
+            price = rate if price is None else Decimal(price)
+            fee = Decimal(fee)
+            if _side(order_type) == 'buy':
+                released = amount * rate
+                self._total[quote] = self._total.get(quote, Decimal(0)) - amount * price
+                self._total[base] = self._total.get(base, Decimal(0)) + amount - fee
+            else:
+                released = amount
+                self._total[base] = self._total.get(base, Decimal(0)) - amount
+                self._total[quote] = self._total.get(quote, Decimal(0)) + amount * price - fee
+            self._locked[asset] -= released
+            entry[1] -= released
+            entry[5] -= amount
+            if entry[5] <= 0:
+                del self._orders[key]
+
+    def on_market_fill(self, order):
+        # Market orders carry no usable price, and a Huobi market buy carries its quote value as amount,
+        # so the fill is booked from what the venue reports executed
+        assets = self._split(order.symbol)
+        execution = self.client.get_execution(order, _symbol_name(order.symbol))
+        if assets is None or execution is None:
+            return
+        base, quote = assets
+        amount, notional = execution['amount'], execution['notional']
+        if _side(order.order_type) == 'sell':
+            amount, notional = -amount, -notional
+        with self._lock:
+            self._total[base] = self._total.get(base, Decimal(0)) + amount
+            self._total[quote] = self._total.get(quote, Decimal(0)) - notional
+
+    def total(self, asset):
+        return self._total.get(asset, Decimal(0))
+
+    def locked(self, asset):
+        return self._locked.get(asset, Decimal(0))
+
+    def free(self, asset):
+        with self._lock:
+            return self.total(asset) - self.locked(asset)
+
+    def balances(self):
+        with self._lock:
+            return dict((asset, {'free': total - self.locked(asset), 'locked': self.locked(asset)})
+                        for asset, total in self._total.items() if total != 0 or self.locked(asset) != 0)
+
+    def reconcile(self, fix=True):
+        # Compare against a fresh REST snapshot, returns {asset: rest - local}
+        fresh = BalanceLedger(self.client)
+        fresh._assets = self._assets
+        fresh.seed()
+        drift = {}
+        with self._lock:
+            for asset in set(fresh._total) | set(self._total):
+                diff = fresh.total(asset) - self.total(asset)
+                if diff != 0:
+                    drift[asset] = diff
+            if fix:
+                self._total, self._locked, self._orders = fresh._total, fresh._locked, fresh._orders
+        if drift:
+            print("Balance drift on {}: {}".format(type(self.client).__name__, drift))
+        return drift
+
+    def start_reconcile(self, interval=300):
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    print("Balance reconcile failed: {}".format(e))
+
+        self._reconciler = threading.Thread(target=run, daemon=True)
+        self._reconciler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
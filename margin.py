@@ -0,0 +1,96 @@
+import threading
+from decimal import Decimal
+
+
+class Position(object):
+
+    def __init__(self, symbol, side, amount, base_price):
+        self.symbol = symbol
+        self.side = side
+        self.amount = amount
+        self.base_price = base_price
+        self.realized = Decimal(0)
+        self.pl = Decimal(0)
+
+    def __repr__(self):
+        return "Position({}, {}, {}, {}, pl={})".format(self.symbol, self.side, self.amount, self.base_price, self.pl)
+
+
+class MarginBook(object):
+
+    def __init__(self):
+        self._positions = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, positions, symbols=None):
+        book = {}
+        for symbol, side, amount, price in positions:
+            self._fill(book, symbol, 'buy' if side == 'long' else 'sell', Decimal(amount), price)
+        with self._lock:
+            if symbols is not None:
+                for symbol, position in self._positions.items():
+                    if symbol not in symbols:
+                        book[symbol] = position
+            self._positions = book
+            self.loaded = symbols is None or self.loaded
+
+    def _fill(self, book, symbol, order_type, amount, price):
+        price = Decimal(price) if price is not None else None
+        signed = amount if order_type == 'buy' else -amount
+        position = book.get(symbol)
+        if position is None or position.amount == 0:
+            # Without a fill price the entry is unknown and the position stays unmarked
+            position = Position(symbol, 'long' if signed > 0 else 'short', abs(signed), price)
+            book[symbol] = position
+            return position
+
+        current = position.amount if position.side == 'long' else -position.amount
+        net = current + signed
+        if (current > 0) == (signed > 0):
+            if price is not None and position.base_price is not None:
+                position.base_price = (position.base_price * abs(current) + price * abs(signed)) / abs(net)
+        else:
+            closed = min(abs(current), abs(signed))
+            if price is not None and position.base_price is not None:
+                direction = 1 if current > 0 else -1
+                position.realized += (price - position.base_price) * closed * direction
+            if net != 0 and (net > 0) != (current > 0):
+                position.base_price = price
+        position.side = 'long' if net > 0 else 'short'
+        position.amount = abs(net)
+        if net == 0:
+            position.pl = Decimal(0)
+        return position
+
+    def apply_fill(self, symbol, order_type, amount, price=None):
+        with self._lock:
+            return self._fill(self._positions, symbol, order_type, Decimal(amount), price)
+
+    def get(self, symbol):
+        position = self._positions.get(symbol)
+        if position is None or position.amount == 0:
+            return None
+        return position
+
+    def positions(self):
+        with self._lock:
+            return [p for p in self._positions.values() if p.amount != 0]
+
+    def mark(self, symbol, bid, ask):
+        position = self.get(symbol)
+        if position is None or position.base_price is None:
+            return None
+        if position.side == 'long':
+            position.pl = (Decimal(bid) - position.base_price) * position.amount
+        else:
+            position.pl = (position.base_price - Decimal(ask)) * position.amount
+        return position.pl
+
+    def mark_all(self, quotes):
+        result = {}
+        for position in self.positions():
+            quote = quotes.get(position.symbol)
+            if quote is not None:
+                result[position.symbol] = self.mark(position.symbol, quote['bid'], quote['ask'])
+        return result
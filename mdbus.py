@@ -0,0 +1,132 @@
+import struct
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+MAGIC = b'MDB1'
+HEADER = struct.Struct('<4sIIIQ')
+NAME = struct.Struct('<16s')
+SLOT = struct.Struct('<Qddddd')
+RECORD = struct.Struct('<QIIddddd')
+HEAD_OFFSET = 16
+
+
+def _layout(nsymbols, capacity):
+    names = HEADER.size
+    slots = names + nsymbols * NAME.size
+    ring = slots + nsymbols * SLOT.size
+    return names, slots, ring, ring + capacity * RECORD.size
+
+
+class MarketDataPublisher(object):
+
+    def __init__(self, client, symbols, name, interval=0.5, capacity=4096):
+        self.client = client
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.capacity = capacity
+        self._index = dict((s, i) for i, s in enumerate(self.symbols))
+        self._names, self._slots, self._ring, size = _layout(len(self.symbols), capacity)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._buf = self._shm.buf
+        HEADER.pack_into(self._buf, 0, MAGIC, 1, len(self.symbols), capacity, 0)
+        for i, symbol in enumerate(self.symbols):
+            NAME.pack_into(self._buf, self._names + i * NAME.size, symbol.encode())
+        self._head = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def publish(self, symbol, bid, bid_size, ask, ask_size, ts=None):
+        i = self._index[symbol]
+        ts = time.time() if ts is None else ts
+        values = (ts, float(bid), float(bid_size), float(ask), float(ask_size))
+
+        # Seqlock: an odd sequence tells readers the slot is being written
+        offset = self._slots + i * SLOT.size
+        seq = struct.unpack_from('<Q', self._buf, offset)[0]
+        struct.pack_into('<Q', self._buf, offset, seq + 1)
+        SLOT.pack_into(self._buf, offset, seq + 1, *values)
+        struct.pack_into('<Q', self._buf, offset, seq + 2)
+
+        offset = self._ring + (self._head % self.capacity) * RECORD.size
+        struct.pack_into('<Q', self._buf, offset, 0)
+        RECORD.pack_into(self._buf, offset, 0, i, 0, *values)
+        struct.pack_into('<Q', self._buf, offset, self._head + 1)
+        self._head += 1
+        struct.pack_into('<Q', self._buf, HEAD_OFFSET, self._head)
+
+    def poll(self):
+        quotes = self.client.get_best_bid_ask(self.symbols)
+        ts = time.time()
+        for symbol, quote in quotes.items():
+            if symbol in self._index:
+                self.publish(symbol, quote['bid'], quote['bid_size'], quote['ask'], quote['ask_size'], ts)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print("Market data bus poll failed: {}".format(e))
+            self._stop.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._buf.release()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class MarketDataReader(object):
+
+    def __init__(self, name):
+        self._shm = shared_memory.SharedMemory(name=name)
+        # The publisher owns the segment, readers must not unlink it on exit
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._buf = self._shm.buf
+        magic, version, nsymbols, self.capacity, _ = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a market data bus".format(name))
+        self._names, self._slots, self._ring, _ = _layout(nsymbols, self.capacity)
+        self.symbols = [NAME.unpack_from(self._buf, self._names + i * NAME.size)[0].rstrip(b'\0').decode()
+                        for i in range(nsymbols)]
+        self._index = dict((s, i) for i, s in enumerate(self.symbols))
+        self.cursor = self.head()
+
+    def head(self):
+        return struct.unpack_from('<Q', self._buf, HEAD_OFFSET)[0]
+
+    def get(self, symbol):
+        offset = self._slots + self._index[symbol] * SLOT.size
+        while True:
+            seq, ts, bid, bid_size, ask, ask_size = SLOT.unpack_from(self._buf, offset)
+            if seq == 0:
+                return None
+            if seq % 2 == 0 and struct.unpack_from('<Q', self._buf, offset)[0] == seq:
+                return {'ts': ts, 'bid': bid, 'bid_size': bid_size, 'ask': ask, 'ask_size': ask_size}
+
+    def updates(self):
+        head = self.head()
+        if head - self.cursor > self.capacity:
+            self.cursor = head - self.capacity
+        while self.cursor < head:
+            offset = self._ring + (self.cursor % self.capacity) * RECORD.size
+            seq, i, _, ts, bid, bid_size, ask, ask_size = RECORD.unpack_from(self._buf, offset)
+            if seq != self.cursor + 1 or struct.unpack_from('<Q', self._buf, offset)[0] != seq:
+                # Overwritten by the publisher while we were reading, resync to the oldest live record
+                self.cursor = max(self.cursor + 1, self.head() - self.capacity)
+                continue
+            self.cursor += 1
+            yield self.symbols[i], {'ts': ts, 'bid': bid, 'bid_size': bid_size, 'ask': ask, 'ask_size': ask_size}
+
+    def close(self):
+        self._buf.release()
+        self._shm.close()
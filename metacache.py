@@ -0,0 +1,123 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'exchange_api')
+
+
+def _encode(obj):
+    if isinstance(obj, Decimal):
+        return {'$d': str(obj)}
+    raise TypeError
+
+
+def _decode(obj):
+    if len(obj) == 1 and '$d' in obj:
+        return Decimal(obj['$d'])
+    return obj
+
+
+class MetadataCache(object):
+
+    def __init__(self, path=DEFAULT_PATH, max_age=3600, stale_age=86400):
+        self.path = path
+        self.max_age = max_age
+        self.stale_age = stale_age
+        self._memory = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, exchange, name):
+        return os.path.join(self.path, '{}_{}.json.z'.format(exchange.lower(), name))
+
+    def _read(self, filename):
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            return None
+        cached = self._memory.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(filename, 'rb') as f:
+                entry = json.loads(zlib.decompress(f.read()).decode(), object_hook=_decode)
+            payload = json.dumps(entry['data'], default=_encode, sort_keys=True)
+        except (OSError, ValueError, KeyError, zlib.error):
+            return None
+        if hashlib.sha256(payload.encode()).hexdigest() != entry['hash']:
+            return None
+        self._memory[filename] = (mtime, entry)
+        return entry
+
+    def _write(self, filename, data):
+        payload = json.dumps(data, default=_encode, sort_keys=True)
+        entry = {'created': time.time(), 'hash': hashlib.sha256(payload.encode()).hexdigest(), 'data': data}
+        blob = zlib.compress(json.dumps(entry, default=_encode, separators=(',', ':')).encode())
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, filename)
+        return entry
+
+    def _refresh(self, filename, fetch, block):
+        with open(filename + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return None
+            try:
+                # Another process may have refreshed the file while we waited for the lock
+                entry = self._read(filename)
+                if entry is not None and time.time() - entry['created'] < self.max_age:
+                    return entry
+                data = fetch()
+                if data is None:
+                    return entry
+                return self._write(filename, data)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh_async(self, filename, fetch):
+        with self._lock:
+            if filename in self._refreshing:
+                return
+            self._refreshing.add(filename)
+
+        def run():
+            try:
+                self._refresh(filename, fetch, block=False)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(filename)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get(self, exchange, name, fetch):
+        filename = self._file(exchange, name)
+        entry = self._read(filename)
+        if entry is not None:
+            age = time.time() - entry['created']
+            if age < self.max_age:
+                return entry['data']
+            if age < self.stale_age:
+                self._refresh_async(filename, fetch)
+                return entry['data']
+        entry = self._refresh(filename, fetch, block=True)
+        if entry is None:
+            return None
+        return entry['data']
+
+    def invalidate(self, exchange, name):
+        filename = self._file(exchange, name)
+        self._memory.pop(filename, None)
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
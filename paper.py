@@ -0,0 +1,304 @@
+import itertools
+import time
+from decimal import Decimal
+
+from .base import Balance
+from .binance import Binance, BinanceOrder, BinanceTrade
+from .kraken import Kraken, KrakenOrder, KrakenTrade
+from .huobi import Huobi, HuobiOrder, HuobiTrade
+from .recorder import BID, ASK, TRADE
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal("{}".format(value))
+
+
+class _NoAuth(object):
+
+    def get_key(self):
+        return ''
+
+    def get_secret(self):
+        return ''
+
+
+class SimulatedVenue(object):
+
+    def __init__(self, balances, maker_fee, taker_fee, assets):
+        self.balances = dict((asset, _decimal(amount)) for asset, amount in balances.items())
+        self.maker_fee = _decimal(maker_fee)
+        self.taker_fee = _decimal(taker_fee)
+        self.assets = assets
+        self.quotes = {}
+        self.orders = {}
+        self.closed = {}
+        self.trades = []
+        self.clock = None
+        self._resting = {}
+        self._ids = itertools.count(1)
+
+    def now(self):
+        return self.clock if self.clock is not None else time.time()
+
+    def _locked(self, asset):
+        locked = Decimal(0)
+        for order in self.orders.values():
+            base, quote = self.assets[order['symbol']]
+            remaining = order['amount'] - order['filled']
+            if order['order_type'] == 'buy' and quote == asset:
+                locked += remaining * order['rate'] * (1 + self.maker_fee)
+            elif order['order_type'] == 'sell' and base == asset:
+                locked += remaining
+        return locked
+
+    def free(self, asset):
+        return self.balances.get(asset, Decimal(0)) - self._locked(asset)
+
+    def _fill(self, order, amount, price, fee_rate):
+        base, quote = self.assets[order['symbol']]
+        price = _decimal(price)
+        notional = amount * price
+        fee = notional * fee_rate
+        if order['order_type'] == 'buy':
+            self.balances[quote] = self.balances.get(quote, Decimal(0)) - notional - fee
+            self.balances[base] = self.balances.get(base, Decimal(0)) + amount
+        else:
+            self.balances[base] = self.balances.get(base, Decimal(0)) - amount
+            self.balances[quote] = self.balances.get(quote, Decimal(0)) + notional - fee
+        order['filled'] += amount
+        self.trades.append({
+            'id': len(self.trades) + 1, 'order_id': order['number'], 'symbol': order['symbol'],
+            'order_type': order['order_type'], 'amount': amount, 'price': price,
+            'fee': fee, 'fee_asset': quote, 'time': self.now(),
+        })
+
+    def _close(self, order):
+        self.orders.pop(order['number'], None)
+        self._resting.get(order['symbol'], {}).pop(order['number'], None)
+        self.closed[order['number']] = order
+
+    def place(self, symbol, order_type, amount, rate=None, market=False):
+        quote = self.quotes.get(symbol, {})
+        top = quote.get('ask') if order_type == 'buy' else quote.get('bid')
+        if market and top is None:
+            return None
+        amount = _decimal(amount)
+        rate = _decimal(rate if rate is not None and not market else top)
+        base, quote_asset = self.assets[symbol]
+        if order_type == 'buy' and self.free(quote_asset) < amount * rate * (1 + self.taker_fee):
+            return None
+        if order_type == 'sell' and self.free(base) < amount:
+            return None
+
+        order = {'number': str(next(self._ids)), 'symbol': symbol, 'order_type': order_type,
+                 'amount': amount, 'rate': rate, 'filled': Decimal(0), 'time': self.now()}
+        marketable = top is not None and (rate >= top if order_type == 'buy' else rate <= top)
+        if marketable:
+            size = quote.get('ask_size' if order_type == 'buy' else 'bid_size')
+            take = amount if size is None else min(amount, _decimal(size))
+            self._fill(order, take, top, self.taker_fee)
+        if market or order['filled'] >= amount:
+            self._close(order)
+        else:
+            self.orders[order['number']] = order
+            self._resting.setdefault(symbol, {})[order['number']] = order
+        return order
+
+    def cancel(self, number):
+        order = self.orders.get(str(number))
+        if order is None:
+            return False
+        self._close(order)
+        return True
+
+    def _match(self, symbol, order_type, price, size):
+        resting = self._resting.get(symbol)
+        if not resting:
+            return
+        for order in list(resting.values()):
+            if order['order_type'] != order_type:
+                continue
+            if (order_type == 'buy' and price > order['rate']) or (order_type == 'sell' and price < order['rate']):
+                continue
+            remaining = order['amount'] - order['filled']
+            take = remaining if size is None else min(remaining, _decimal(size))
+            if take <= 0:
+                continue
+            # Resting orders fill at their own limit as maker
+            self._fill(order, take, order['rate'], self.maker_fee)
+            if order['filled'] >= order['amount']:
+                self._close(order)
+
+    def update_quote(self, symbol, bid=None, bid_size=None, ask=None, ask_size=None):
+        quote = self.quotes.setdefault(symbol, {})
+        if bid is not None:
+            quote['bid'], quote['bid_size'] = bid, bid_size
+            self._match(symbol, 'sell', bid, bid_size)
+        if ask is not None:
+            quote['ask'], quote['ask_size'] = ask, ask_size
+            self._match(symbol, 'buy', ask, ask_size)
+
+    def on_trade(self, symbol, price, size):
+        self._match(symbol, 'buy', price, size)
+        self._match(symbol, 'sell', price, size)
+
+
+class PaperTrading(object):
+    FEES = {'maker_fee': Decimal('0.002'), 'taker_fee': Decimal('0.002')}
+
+    def __init__(self, balances, fees=None, assets=None, live=True, **kwargs):
+        if not live and assets is None:
+            # Backtests must not reach the real venue, symbol assets can't be fetched
+            raise ValueError("Backtest mode needs assets: {symbol: (base, quote)}")
+        super(PaperTrading, self).__init__(_NoAuth(), **kwargs)
+        self.live = live
+        fees = fees or self.FEES
+        self.venue = SimulatedVenue(balances, fees['maker_fee'], fees['taker_fee'],
+                                    assets or super(PaperTrading, self).get_symbol_assets())
+
+    def _refresh(self, symbols):
+        if not self.live or not symbols:
+            return
+        quotes = super(PaperTrading, self).get_best_bid_ask(list(symbols))
+        for symbol, quote in quotes.items():
+            self.venue.update_quote(symbol, quote['bid'], quote['bid_size'], quote['ask'], quote['ask_size'])
+
+    def _open_symbols(self):
+        return set(o['symbol'] for o in self.venue.orders.values())
+
+    def get_best_bid_ask(self, symbols=None):
+        if self.live:
+            return super(PaperTrading, self).get_best_bid_ask(symbols)
+        return dict((s, dict(q)) for s, q in self.venue.quotes.items() if symbols is None or s in symbols)
+
+    def get_feeinfo(self, symbol=None):
+        return {'maker_fee': self.venue.maker_fee, 'taker_fee': self.venue.taker_fee}
+
+    def new_order(self, rate, order_type, amount, symbol, market=False):
+        self._refresh([symbol])
+        order = self.venue.place(symbol, order_type, amount, rate, market)
+        if order is None:
+            print("Paper order rejected", symbol, order_type, amount, rate)
+            return None
+        filled = order['number'] in self.venue.closed and order['filled'] >= order['amount']
+        return self._track_order(self._order_object(order), filled)
+
+    def cancel_order(self, order):
+        if not self.venue.cancel(order.number):
+            return False
+        if self.ledger is not None:
+            self.ledger.on_cancel(order)
+        return True
+
+    def move_order(self, order, rate, amount):
+        placed = self.venue.orders.get(str(order.number))
+        if placed is None or not self.cancel_order(order):
+            return None
+        moved = self.new_order(rate, placed['order_type'], amount, placed['symbol'])
+        if moved:
+            return moved.number
+        return None
+
+    def close_order(self, order):
+        placed = self.venue.orders.get(str(order.number))
+        if placed is None or not self.cancel_order(order):
+            return False
+        remaining = placed['amount'] - placed['filled']
+        return self.new_order(None, placed['order_type'], remaining, placed['symbol'], market=True) is not None
+
+    def get_open_orders(self, pairs=None):
+        self._refresh(self._open_symbols())
+        return [self._order_object(o) for o in self.venue.orders.values() if pairs is None or o['symbol'] == pairs]
+
+    def is_order_fulfilled(self, order):
+        self._refresh(self._open_symbols())
+        placed = self.venue.closed.get(str(order.number))
+        if placed is None or placed['filled'] < placed['amount']:
+            return False
+        if self.ledger is not None:
+            self.ledger.on_fill(order)
+        return True
+
+    def get_execution(self, order, symbol=None):
+        trades = [t for t in self.venue.trades if t['order_id'] == str(order.number)]
+        return {'amount': sum((t['amount'] for t in trades), Decimal(0)),
+                'notional': sum((t['amount'] * t['price'] for t in trades), Decimal(0))}
+
+    def get_full_balance(self):
+        return [Balance(asset, amount, type='exchange') for asset, amount in self.venue.balances.items() if amount != 0]
+
+    def get_trade_history(self, start=None, end=None, limit=1000, pairs=None):
+        trades = [t for t in self.venue.trades if pairs is None or t['symbol'] == pairs]
+        return [self._trade_object(t) for t in trades[-limit:]]
+
+
+class PaperBinance(PaperTrading, Binance):
+    FEES = {'maker_fee': Decimal('0.001'), 'taker_fee': Decimal('0.001')}
+
+    def _order_object(self, o):
+        return BinanceOrder.create_object_from_json({
+            'orderId': o['number'], 'price': o['rate'], 'side': o['order_type'].upper(),
+            'origQty': o['amount'], 'symbol': o['symbol'],
+        })
+
+    def _trade_object(self, t):
+        return BinanceTrade.create_object_from_json({
+            'commissionAsset': t['fee_asset'], 'orderId': t['order_id'], 'id': t['id'],
+            'isBuyer': t['order_type'] == 'buy', 'qty': t['amount'], 'price': t['price'],
+            'commission': t['fee'], 'time': t['time'] * 1000,
+        })
+
+
+class PaperKraken(PaperTrading, Kraken):
+    FEES = {'maker_fee': Decimal('0.0016'), 'taker_fee': Decimal('0.0026')}
+
+    def _order_object(self, o):
+        return KrakenOrder.create_object_from_json({
+            'orderId': o['number'], 'rate': o['rate'], 'type': o['order_type'],
+            'amount': o['amount'], 'symbol': o['symbol'],
+        })
+
+    def _trade_object(self, t):
+        return KrakenTrade.create_object_from_json({
+            'pair': t['symbol'], 'ordertxid': t['order_id'], 'type': t['order_type'],
+            'vol': t['amount'], 'price': t['price'], 'fee': t['fee'], 'time': t['time'],
+        })
+
+
+class PaperHuobi(PaperTrading, Huobi):
+    FEES = {'maker_fee': Decimal('0.002'), 'taker_fee': Decimal('0.002')}
+
+    def _order_object(self, o):
+        return HuobiOrder.create_object_from_json({
+            'id': o['number'], 'price': o['rate'], 'type': '{}-limit'.format(o['order_type']),
+            'amount': o['amount'], 'field-cash-amount': o['filled'], 'symbol': o['symbol'],
+        })
+
+    def _trade_object(self, t):
+        return HuobiTrade.create_object_from_json({
+            'symbol': t['symbol'], 'id': t['id'], 'type': '{}-limit'.format(t['order_type']),
+            'price': t['price'], 'amount': t['amount'], 'field-fees': t['fee'],
+        })
+
+
+class Backtest(object):
+
+    def __init__(self, client, reader):
+        self.client = client
+        self.reader = reader
+
+    def run(self, start=None, end=None, on_tick=None):
+        venue = self.client.venue
+        count = 0
+        for ts, symbol, kind, price, size in self.reader.replay(start, end):
+            venue.clock = ts
+            if kind == BID:
+                venue.update_quote(symbol, bid=price, bid_size=size)
+            elif kind == ASK:
+                venue.update_quote(symbol, ask=price, ask_size=size)
+            elif kind == TRADE:
+                venue.on_trade(symbol, price, size)
+            if on_tick is not None:
+                on_tick(ts, symbol)
+            count += 1
+        return count
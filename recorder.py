@@ -0,0 +1,163 @@
+import bisect
+import heapq
+import itertools
+import struct
+import threading
+import time
+import zlib
+
+CHUNK = struct.Struct('<4sIIIdd')
+RECORD = struct.Struct('<dHBdd')
+INDEX = struct.Struct('<ddQ')
+MAGIC = b'TCK1'
+
+BID, ASK, TRADE = 0, 1, 2
+
+
+class TickWriter(object):
+
+    def __init__(self, path, chunk_size=10000):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._data = open(path + '.ticks', 'ab')
+        self._index = open(path + '.idx', 'ab')
+        self._symbols = {}
+        self._records = []
+        self._lock = threading.Lock()
+
+    def write(self, ts, symbol, kind, price, size):
+        with self._lock:
+            sid = self._symbols.setdefault(symbol, len(self._symbols))
+            self._records.append(RECORD.pack(ts, sid, kind, float(price), float(size)))
+            if len(self._records) >= self.chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._records:
+            return
+        # Caller timestamps from other feeds can arrive out of order, chunks are stored time sorted
+        self._records.sort(key=lambda r: RECORD.unpack_from(r)[0])
+        symbols = sorted(self._symbols, key=self._symbols.get)
+        table = '\n'.join(symbols).encode()
+        payload = zlib.compress(b''.join(self._records))
+        first = RECORD.unpack(self._records[0])[0]
+        last = RECORD.unpack(self._records[-1])[0]
+        offset = self._data.tell()
+        self._data.write(CHUNK.pack(MAGIC, len(table), len(payload), len(self._records), first, last))
+        self._data.write(table)
+        self._data.write(payload)
+        self._data.flush()
+        self._index.write(INDEX.pack(first, last, offset))
+        self._index.flush()
+        self._records = []
+        self._symbols = {}
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+class MarketDataRecorder(object):
+
+    def __init__(self, client, path, symbols, interval=1.0, chunk_size=10000):
+        self.client = client
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.writer = TickWriter(path, chunk_size)
+        self._last = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def record(self, symbol, kind, price, size, ts=None):
+        self.writer.write(time.time() if ts is None else ts, symbol, kind, price, size)
+
+    def poll(self):
+        quotes = self.client.get_best_bid_ask(self.symbols)
+        ts = time.time()
+        for symbol, quote in quotes.items():
+            # Only changes of the top of book are written
+            for kind, price, size in ((BID, quote['bid'], quote['bid_size']), (ASK, quote['ask'], quote['ask_size'])):
+                if self._last.get((symbol, kind)) != (price, size):
+                    self._last[(symbol, kind)] = (price, size)
+                    self.record(symbol, kind, price, size, ts)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print("Market data recorder poll failed: {}".format(e))
+            self._stop.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.writer.close()
+
+
+class TickReader(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.idx', 'rb') as f:
+            self._index = [INDEX.unpack(e) for e in iter(lambda: f.read(INDEX.size), b'') if len(e) == INDEX.size]
+        self._index.sort()
+        self._first = [first for first, _, _ in self._index]
+        self._last = []
+        for _, last, _ in self._index:
+            self._last.append(max(last, self._last[-1]) if self._last else last)
+
+    def __len__(self):
+        return len(self._index)
+
+    def _chunk(self, f, offset):
+        f.seek(offset)
+        magic, table_len, payload_len, count, first, last = CHUNK.unpack(f.read(CHUNK.size))
+        if magic != MAGIC:
+            raise ValueError("Corrupt tick chunk at {}".format(offset))
+        symbols = f.read(table_len).decode().split('\n')
+        return symbols, zlib.decompress(f.read(payload_len))
+
+    def _records(self, f, offset, start, end):
+        symbols, payload = self._chunk(f, offset)
+        for ts, sid, kind, price, size in RECORD.iter_unpack(payload):
+            if start is not None and ts < start:
+                continue
+            if end is not None and ts >= end:
+                return
+            yield ts, symbols[sid], kind, price, size
+
+    def _push(self, heap, counter, records):
+        for record in records:
+            heapq.heappush(heap, (record[0], next(counter), record, records))
+            return
+
+    def replay(self, start=None, end=None):
+        # The first chunk that can hold `start` is found by bisection on the running max of last timestamps
+        i = 0 if start is None else bisect.bisect_left(self._last, start)
+        j = len(self._index) if end is None else bisect.bisect_left(self._first, end)
+        heap = []
+        counter = itertools.count()
+        with open(self.path + '.ticks', 'rb') as f:
+            while True:
+                # Chunks can overlap in time: every chunk starting by the earliest pending tick joins the merge
+                while i < j and (not heap or self._index[i][0] <= heap[0][0]):
+                    self._push(heap, counter, self._records(f, self._index[i][2], start, end))
+                    i += 1
+                if not heap:
+                    return
+                _, _, record, records = heapq.heappop(heap)
+                yield record
+                self._push(heap, counter, records)
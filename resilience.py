@@ -0,0 +1,138 @@
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+
+from .transport import TRANSPORT_ERRORS
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Hedged sends get their own workers: callers often already run on the fan-out pool, and waiting
+# there on work queued behind themselves can deadlock it
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryPolicy(object):
+
+    def __init__(self, attempts=3, backoff=0.2, max_backoff=2.0):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold=5, reset_after=30):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # Half-open: let one probe through once the cool-down has passed
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def endpoint_key(url):
+    path = urlparse(url).path
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+
+def failed_response(url, error):
+    response = requests.Response()
+    response.status_code = 599
+    response.url = url
+    response._content = json.dumps({'status': 'error', 'err-msg': str(error)}).encode()
+    return response
+
+
+class Resilience(object):
+
+    def __init__(self, timeout=(3.05, 10), retry=None, breaker_threshold=5, breaker_reset=30, hedge_after=None):
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.hedge_after = hedge_after
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    endpoint, CircuitBreaker(self.breaker_threshold, self.breaker_reset))
+        return breaker
+
+    def _hedged(self, send):
+        first = _hedge_pool.submit(send, self.timeout)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        second = _hedge_pool.submit(send, self.timeout)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, endpoint, send, idempotent=False, hedge=False):
+        breaker = self.breaker(endpoint)
+        # Orders are never resent: a timed out submit may still have reached the venue
+        attempts = self.retry.attempts if idempotent else 1
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(endpoint)
+            last = attempt + 1 == attempts
+            try:
+                if hedge and idempotent and self.hedge_after is not None:
+                    response = self._hedged(send)
+                else:
+                    response = send(self.timeout)
+            except TRANSPORT_ERRORS:
+                breaker.record_failure()
+                if last:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if last:
+                    return response
+            time.sleep(self.retry.delay(attempt))
@@ -0,0 +1,108 @@
+from decimal import Decimal
+
+from .fanout import get_pool
+from .fees import FeeEngine
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal("{}".format(value))
+
+
+class SmartOrderRouter(object):
+
+    def __init__(self, venues, depth=20, fee_ttl=3600):
+        # venues: (client, symbol) pairs quoting the same instrument under venue specific names
+        self.venues = list(venues)
+        self.depth = depth
+        self.fee_ttl = fee_ttl
+        self._fees = {}
+
+    def _venue_constraints(self, client, symbol):
+        engine = self._fees.get(id(client))
+        if engine is None:
+            engine = self._fees[id(client)] = FeeEngine(client, self.fee_ttl)
+        fee = engine.get(symbol) or {'taker_fee': 0}
+        filters = dict((f['pairs'], f) for f in (client.get_filters() or []))
+        f = filters.get(symbol, {'min_amount': 0, 'min_lot': 0})
+        return _decimal(fee['taker_fee']), _decimal(f['min_amount']), _decimal(f['min_lot'])
+
+    def _load(self):
+        # Fees and filters load on the calling thread: fee schedules fan out on the shared pool
+        # themselves, and waiting on them from a pool worker can deadlock it
+        futures = [get_pool().submit(c.get_depth, s, self.depth) for c, s in self.venues]
+        result = []
+        for (client, symbol), future in zip(self.venues, futures):
+            try:
+                fee, step, min_notional = self._venue_constraints(client, symbol)
+                book = future.result()
+            except Exception as e:
+                print("Router can't load {} {}: {}".format(type(client).__name__, symbol, e))
+                continue
+            if book is not None:
+                result.append((client, symbol, book, fee, step, min_notional))
+        return result
+
+    def plan(self, order_type, amount):
+        amount = _decimal(amount)
+        venues = self._load()
+        levels = []
+        for i, (client, symbol, book, fee, step, min_notional) in enumerate(venues):
+            side = book['asks'] if order_type == 'buy' else book['bids']
+            cost = Decimal(1) + fee if order_type == 'buy' else Decimal(1) - fee
+            for price, size in side:
+                levels.append((price * cost, price, size, i))
+        # Cheapest effective price first when buying, richest first when selling
+        levels.sort(key=lambda l: l[0], reverse=order_type == 'sell')
+
+        fills = {}
+        left = amount
+        for effective, price, size, i in levels:
+            if left <= 0:
+                break
+            take = min(size, left)
+            qty, notional, worst = fills.get(i, (Decimal(0), Decimal(0), price))
+            fills[i] = (qty + take, notional + take * price, price)
+            left -= take
+
+        children = []
+        for i, (qty, notional, worst) in fills.items():
+            client, symbol, book, fee, step, min_notional = venues[i]
+            if step > 0:
+                qty = (qty // step) * step
+            if qty <= 0 or qty * worst < min_notional:
+                continue
+            children.append({
+                'client': client, 'symbol': symbol, 'amount': qty, 'rate': worst,
+                'expected_price': notional / fills[i][0], 'fee': fee,
+            })
+        return children
+
+    def execute(self, order_type, amount):
+        children = self.plan(order_type, amount)
+        futures = [get_pool().submit(c['client'].new_order, c['rate'], order_type, c['amount'], c['symbol'])
+                   for c in children]
+
+        filled = Decimal(0)
+        expected = Decimal(0)
+        achieved = Decimal(0)
+        for child, future in zip(children, futures):
+            order = future.result() if future.exception() is None else None
+            child['order'] = order
+            expected += child['expected_price'] * child['amount']
+            if order is None:
+                continue
+            # Limit children fill at or inside their worst level, the venue reports what actually executed
+            execution = child['client'].get_execution(order, child['symbol'])
+            child['execution'] = execution
+            if execution is not None:
+                filled += execution['amount']
+                achieved += execution['notional']
+
+        planned = sum((c['amount'] for c in children), Decimal(0))
+        return {
+            'children': children,
+            'requested': _decimal(amount),
+            'filled': filled,
+            'expected_price': expected / planned if planned else None,
+            'achieved_price': achieved / filled if filled else None,
+        }
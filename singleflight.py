@@ -0,0 +1,93 @@
+import functools
+import threading
+import time
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        self._calls = {}
+        self._recent = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, ttl=0):
+        with self._lock:
+            stats = self._stats.setdefault(key, {'calls': 0, 'shared': 0, 'cached': 0})
+            stats['calls'] += 1
+            recent = self._recent.get(key)
+            if recent is not None and time.monotonic() - recent[0] < ttl:
+                stats['cached'] += 1
+                return recent[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                stats['shared'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+        with self._lock:
+            del self._calls[key]
+            # Failed calls (None) are not kept, so the next caller retries
+            if call.error is None and call.result is not None and ttl:
+                self._recent[key] = (time.monotonic(), call.result)
+        call.event.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return dict((key, dict(value)) for key, value in self._stats.items())
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(v) for v in value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def coalesce(ttl_attr=None):
+    # Concurrent identical calls share one request, results are shared objects and must not be mutated
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            flights = self.__dict__.get('_flights')
+            if flights is None:
+                flights = self.__dict__.setdefault('_flights', SingleFlight())
+            key = (method.__name__, _freeze(args), _freeze(kwargs))
+            try:
+                hash(key)
+            except TypeError:
+                return method(self, *args, **kwargs)
+            ttl = getattr(self, ttl_attr) if ttl_attr else 0
+            return flights.do(key, lambda: method(self, *args, **kwargs), ttl)
+        return wrapper
+    return decorator
+
+
+def coalescing_stats(client):
+    flights = client.__dict__.get('_flights')
+    return flights.stats() if flights is not None else {}
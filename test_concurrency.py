@@ -0,0 +1,199 @@
+import itertools
+import json
+import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from exchange_api.binance import Binance
+from exchange_api.huobi import Huobi
+from exchange_api.kraken import Kraken
+from exchange_api.transport import Transport
+
+THREADS = 64
+ORDERS_PER_THREAD = 10
+SYMBOLS = {'binance': 'BTCUSDT', 'kraken': 'XBTUSD', 'huobi': 'btcusdt'}
+
+
+class Auth(object):
+
+    def get_key(self):
+        return 'key'
+
+    def get_secret(self):
+        # Kraken base64-decodes its secret
+        return 'c2VjcmV0'
+
+
+class MockVenue(object):
+
+    def __init__(self):
+        self.orders = {}
+        self.placed = 0
+        self.cancelled = 0
+        self.nonces = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def place(self, order=None):
+        with self._lock:
+            number = str(next(self._ids))
+            self.orders[number] = order or {}
+            self.placed += 1
+            return number
+
+    def cancel(self, number):
+        with self._lock:
+            if self.orders.pop(str(number), None) is None:
+                return False
+            self.cancelled += 1
+            return True
+
+    def nonce(self, value):
+        with self._lock:
+            self.nonces.append(value)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    venue = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+    def _route(self, method):
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        venue = self.venue
+
+        if url.path == '/api/v3/order':
+            if method == 'POST':
+                return self._reply({'orderId': venue.place(), 'price': query['price'], 'side': query['side'].upper(),
+                                    'origQty': query['quantity'], 'symbol': query['symbol'], 'fills': []})
+            if venue.cancel(query['orderId']):
+                return self._reply({'orderId': query['orderId'], 'clientOrderId': 'c' + query['orderId']})
+            return self._reply({'code': -2011, 'msg': 'Unknown order sent.'}, 400)
+
+        if url.path.startswith('/0/private/'):
+            form = dict((k, v[0]) for k, v in parse_qs(body).items())
+            venue.nonce(int(form['nonce']))
+            if url.path.endswith('/AddOrder'):
+                return self._reply({'error': [], 'result': {'txid': [venue.place()]}})
+            if url.path.endswith('/CancelOrder') and venue.cancel(form['txid']):
+                return self._reply({'error': [], 'result': {'count': 1}})
+            return self._reply({'error': ['EOrder:Unknown order']})
+
+        if url.path == '/v1/account/accounts':
+            return self._reply({'status': 'ok', 'data': [{'id': 1, 'type': 'spot', 'subtype': ''}]})
+        if url.path == '/v1/order/orders/place':
+            params = json.loads(body)
+            return self._reply({'status': 'ok', 'data': venue.place(params)})
+        match = re.match(r'^/v1/order/orders/(\d+)(/submitcancel)?$', url.path)
+        if match and match.group(2):
+            if venue.cancel(match.group(1)):
+                return self._reply({'status': 'ok', 'data': match.group(1)})
+            return self._reply({'status': 'error', 'err-msg': 'order not found'}, 400)
+        if match:
+            order = venue.orders.get(match.group(1))
+            if order is None:
+                return self._reply({'status': 'error', 'err-msg': 'order not found'}, 400)
+            return self._reply({'status': 'ok', 'data': dict(order, id=match.group(1), **{'field-cash-amount': '0'})})
+
+        self._reply({'error': 'not found'}, 404)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 64 threads connect at once
+    request_queue_size = 128
+
+
+@pytest.fixture
+def server():
+    venue = MockVenue()
+    httpd = MockServer(('127.0.0.1', 0), type('Handler', (MockHandler,), {'venue': venue}))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1]), venue
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_client(name, url, transport):
+    if name == 'binance':
+        client = Binance(Auth(), transport=transport)
+        client.URL = url + '/api/'
+    elif name == 'kraken':
+        client = Kraken(Auth(), transport=transport)
+        client.GET_URL = url + '/0/public/{}'
+        client.POST_URL = url + '/0/private/{}'
+    else:
+        client = Huobi(Auth(), transport=transport)
+        client.MARKET_URL = client.TRADE_URL = url
+    return client
+
+
+@pytest.mark.parametrize('name', ['binance', 'kraken', 'huobi'])
+def test_shared_client_places_and_cancels_from_64_threads(server, name):
+    url, venue = server
+    transport = Transport()
+    client = make_client(name, url, transport)
+
+    issued = defaultdict(list)
+    if name == 'kraken':
+        nonce = client._nonce
+
+        def recording_nonce():
+            value = nonce()
+            issued[threading.get_ident()].append(value)
+            return value
+        client._nonce = recording_nonce
+
+    def worker(i):
+        numbers = []
+        for j in range(ORDERS_PER_THREAD):
+            order = client.new_order(Decimal('100.5'), 'buy' if (i + j) % 2 else 'sell', Decimal('0.01'), SYMBOLS[name])
+            assert order is not None
+            assert client.cancel_order(order)
+            numbers.append(str(order.number))
+        return numbers
+
+    # map re-raises the first exception of any worker
+    with ThreadPoolExecutor(THREADS) as pool:
+        results = list(pool.map(worker, range(THREADS)))
+    transport.close()
+
+    numbers = [number for numbers in results for number in numbers]
+    assert len(numbers) == len(set(numbers)) == THREADS * ORDERS_PER_THREAD
+    assert venue.placed == venue.cancelled == len(numbers)
+    assert not venue.orders
+
+    if name == 'kraken':
+        for values in issued.values():
+            assert all(a < b for a, b in zip(values, values[1:]))
+        generated = [value for values in issued.values() for value in values]
+        assert len(generated) == len(set(generated)) == 2 * len(numbers)
+        assert sorted(venue.nonces) == sorted(generated)
@@ -0,0 +1,167 @@
+from decimal import Decimal
+
+from exchange_api.execution import ExecutionScheduler, Peg, Twap
+from exchange_api.huobi import Huobi
+from exchange_api.kraken import Kraken
+
+ASSET_PAIRS = {'XXBTZUSD': {'altname': 'XBTUSD', 'base': 'XXBT', 'quote': 'ZUSD', 'lot_decimals': 8}}
+
+
+class Auth(object):
+
+    def get_key(self):
+        return 'key'
+
+    def get_secret(self):
+        return 'c2VjcmV0'
+
+
+class FakeKraken(Kraken):
+
+    def __init__(self):
+        super(FakeKraken, self).__init__(Auth())
+        self.sent = []
+
+    def _public(self, method, params=None):
+        if method == 'AssetPairs':
+            return {'error': [], 'result': ASSET_PAIRS}
+        if method == 'Ticker':
+            return {'error': [], 'result': {'XXBTZUSD': {
+                'a': ['101', '1', '3'], 'b': ['100', '1', '2'], 'c': ['100.5', '0.1'], 'v': ['1', '2']}}}
+        return {'error': ['EGeneral:Unknown method']}
+
+    def _private(self, method, data=None):
+        if method == 'AddOrder':
+            self.sent.append(dict(data))
+            return {'error': [], 'result': {'txid': ['T{}'.format(len(self.sent))]}}
+        return {'error': ['EGeneral:Unknown method']}
+
+
+class Response(object):
+
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+
+class FakeHuobi(Huobi):
+
+    def __init__(self):
+        super(FakeHuobi, self).__init__(Auth())
+        self.sent = []
+
+    def get_best_bid_ask(self, symbols=None):
+        return {'btcusdt': {'bid': Decimal(100), 'bid_size': Decimal(2), 'ask': Decimal(101), 'ask_size': Decimal(3)}}
+
+    def _get_accounts(self):
+        return {'status': 'ok', 'data': [{'id': 1, 'type': 'spot'}]}
+
+    def api_key_post(self, params, request_path):
+        self.sent.append(dict(params))
+        return Response({'status': 'ok', 'data': str(len(self.sent))})
+
+    def _get_order_info(self, order_id):
+        params = self.sent[int(order_id) - 1]
+        return {'status': 'ok', 'data': {
+            'id': order_id, 'price': '0.0', 'type': params['type'], 'amount': str(params['amount']),
+            'field-cash-amount': str(params['amount']), 'symbol': params['symbol']}}
+
+
+def run(parent, steps):
+    scheduler = ExecutionScheduler()
+    due = 0
+    for i in range(steps):
+        due = parent.step(scheduler, i)
+        if due is None:
+            break
+    return due
+
+
+def test_market_twap_on_kraken_places_each_slice_once():
+    client = FakeKraken()
+    twap = Twap(client, 'XBTUSD', 'buy', Decimal(3), duration=3, slices=3)
+    assert run(twap, 10) is None
+    assert twap.done
+    assert twap.placed == 3
+    assert twap.filled == 3
+    assert [(o['type'], o['ordertype'], o['volume']) for o in client.sent] == [('buy', 'market', 1.0)] * 3
+
+
+def test_market_twap_on_huobi_sizes_buys_from_the_ask():
+    client = FakeHuobi()
+    twap = Twap(client, 'btcusdt', 'buy', Decimal(2), duration=2, slices=2)
+    assert run(twap, 10) is None
+    assert twap.filled == 2
+    assert [(o['type'], o['amount']) for o in client.sent] == [('buy-market', Decimal(101))] * 2
+
+
+def test_failed_placement_is_not_resent():
+    client = FakeKraken()
+
+    def broken(rate, order_type, amount, symbol, market=False):
+        client.sent.append(amount)
+        raise ValueError('venue answered with an unexpected body')
+    client.new_order = broken
+    twap = Twap(client, 'XBTUSD', 'sell', Decimal(2), duration=2, slices=2)
+    scheduler = ExecutionScheduler()
+    for i in range(6):
+        try:
+            twap.step(scheduler, i)
+        except ValueError:
+            pass
+    # Two slices and one final sweep, however many times the scheduler retries
+    assert len(client.sent) == 3
+
+
+class Child(object):
+
+    def __init__(self, number, rate, amount):
+        self.number = number
+        self.rate = rate
+        self.amount = amount
+
+
+class StuckVenue(object):
+    # Cancels fail and nothing fills, as with a timed out CancelOrder on a live order
+
+    def __init__(self):
+        self.placed = []
+        self.quote = {'bid': Decimal(100), 'bid_size': Decimal(1), 'ask': Decimal(101), 'ask_size': Decimal(1)}
+
+    def get_best_bid_ask(self, symbols=None):
+        return {'XBTUSD': self.quote}
+
+    def new_order(self, rate, order_type, amount, symbol, market=False):
+        self.placed.append((rate, amount, market))
+        return Child(str(len(self.placed)), rate, amount)
+
+    def is_order_fulfilled(self, order):
+        return False
+
+    def cancel_order(self, order):
+        return False
+
+    def get_execution(self, order, symbol=None):
+        return {'amount': Decimal(0), 'notional': Decimal(0)}
+
+
+def test_peg_does_not_replace_a_child_it_could_not_cancel():
+    client = StuckVenue()
+    peg = Peg(client, 'XBTUSD', 'buy', Decimal(1), threshold=Decimal('0.5'))
+    scheduler = ExecutionScheduler(quote_ttl=0)
+    peg.step(scheduler, 0)
+    client.quote = dict(client.quote, bid=Decimal(105), ask=Decimal(106))
+    peg.step(scheduler, 1)
+    peg.step(scheduler, 2)
+    assert client.placed == [(Decimal(100), Decimal(1), False)]
+
+
+def test_twap_does_not_sweep_while_a_child_may_be_live():
+    client = StuckVenue()
+    twap = Twap(client, 'XBTUSD', 'buy', Decimal(2), duration=2, slices=2, rate=Decimal(99))
+    assert run(twap, 6) is not None
+    assert not twap.done
+    assert [market for _, _, market in client.placed] == [False, False]
@@ -0,0 +1,36 @@
+from exchange_api.binance import Binance
+from exchange_api.keypool import ClientPool
+
+
+class Auth(object):
+
+    def __init__(self, key):
+        self.key = key
+
+    def get_key(self):
+        return self.key
+
+    def get_secret(self):
+        return 'secret'
+
+
+class FakeBinance(Binance):
+
+    def signed_request(self, method, path, params, url=None):
+        if self._key == 'banned':
+            return {'code': -2015, 'msg': 'Invalid API-key, IP, or permissions for action.'}
+        if path == 'v3/account':
+            return {'balances': [{'asset': 'BTC', 'free': '1', 'locked': '0'}]}
+        return []
+
+
+def test_a_failed_key_fails_the_aggregate():
+    pool = ClientPool(FakeBinance, [Auth('ok'), Auth('banned')])
+    assert pool.get_full_balance() is None
+    assert pool.get_open_orders() is None
+
+
+def test_aggregate_sums_every_key():
+    pool = ClientPool(FakeBinance, [Auth('ok'), Auth('ok')])
+    assert [(b.currency, b.amount) for b in pool.get_full_balance()] == [('BTC', 2)]
+    assert pool.get_open_orders() == []
@@ -0,0 +1,112 @@
+from decimal import Decimal
+
+from exchange_api.base import Balance
+from exchange_api.huobi import Huobi
+from exchange_api.ledger import BalanceLedger
+
+
+class Auth(object):
+
+    def get_key(self):
+        return 'key'
+
+    def get_secret(self):
+        return 'secret'
+
+
+class Response(object):
+
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+
+class FakeHuobi(Huobi):
+
+    def __init__(self, balances):
+        super(FakeHuobi, self).__init__(Auth())
+        self.balances = balances
+        self.orders = {}
+
+    def get_symbol_assets(self):
+        return {'btcusdt': ('btc', 'usdt')}
+
+    def get_full_balance(self):
+        return [Balance(currency, amount, 'trade') for currency, amount in self.balances.items()]
+
+    def get_open_orders(self, pairs=None):
+        return []
+
+    def _get_accounts(self):
+        return {'status': 'ok', 'data': [{'id': 1, 'type': 'spot'}]}
+
+    def api_key_post(self, params, request_path):
+        number = str(len(self.orders) + 1)
+        market = params['type'].endswith('market')
+        # A market buy of 1000 USDT fills 10 BTC at 100
+        self.orders[number] = {
+            'id': number, 'symbol': params['symbol'], 'type': params['type'],
+            'price': '0.0' if market else str(params['price']), 'amount': str(params['amount']),
+            'field-amount': '10' if market else '0', 'field-cash-amount': '1000' if market else '0',
+        }
+        return Response({'status': 'ok', 'data': number})
+
+    def _get_order_info(self, order_id):
+        return {'status': 'ok', 'data': self.orders[order_id]}
+
+
+def test_huobi_limit_buy_locks_quote():
+    client = FakeHuobi({'btc': Decimal(1), 'usdt': Decimal(1000)})
+    client.ledger = BalanceLedger(client).seed()
+    client.new_order(Decimal(100), 'buy', Decimal(2), 'btcusdt')
+    assert client.ledger.locked('usdt') == 200
+    assert client.ledger.free('btc') == 1
+
+
+def test_huobi_market_buy_is_booked_from_the_execution():
+    client = FakeHuobi({'btc': Decimal(1), 'usdt': Decimal(1000)})
+    client.ledger = BalanceLedger(client).seed()
+    client.new_order(Decimal(100), 'buy', Decimal(10), 'btcusdt', market=True)
+    assert client.ledger.total('btc') == 11
+    assert client.ledger.total('usdt') == 0
+    assert client.ledger.locked('usdt') == 0
+
+
+class FakeHuobiAccount(Huobi):
+
+    def __init__(self):
+        super(FakeHuobiAccount, self).__init__(Auth())
+        self.paths = []
+
+    def get_symbol_assets(self):
+        return {'btcusdt': ('btc', 'usdt')}
+
+    def _get_accounts(self):
+        return {'status': 'ok', 'data': [{'id': 1, 'type': 'spot'}]}
+
+    def api_key_get(self, params, request_path):
+        self.paths.append((request_path, params.get('symbol')))
+        if request_path == '/v1/account/accounts/1/balance':
+            return Response({'status': 'ok', 'data': {'list': [
+                {'currency': 'usdt', 'type': 'trade', 'balance': '800'},
+                {'currency': 'usdt', 'type': 'frozen', 'balance': '200'},
+                {'currency': 'btc', 'type': 'trade', 'balance': '1'},
+            ]}})
+        if request_path == '/v1/order/openOrders':
+            return Response({'status': 'ok', 'data': [{
+                'id': 7, 'symbol': 'btcusdt', 'type': 'buy-limit', 'price': '100', 'amount': '2',
+                'filled-cash-amount': '0',
+            }]})
+        return Response({'status': 'error', 'err-msg': 'unexpected {}'.format(request_path)}, 400)
+
+
+def test_huobi_seed_counts_frozen_funds_and_open_orders():
+    client = FakeHuobiAccount()
+    ledger = BalanceLedger(client).seed()
+    assert ledger.total('usdt') == 1000
+    assert ledger.locked('usdt') == 200
+    assert ledger.free('usdt') == 800
+    assert ('/v1/order/openOrders', None) in client.paths
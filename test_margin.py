@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+from exchange_api.kraken import Kraken
+from exchange_api.margin import MarginBook
+
+ASSET_PAIRS = {'XXBTZUSD': {'altname': 'XBTUSD', 'base': 'XXBT', 'quote': 'ZUSD', 'lot_decimals': 8}}
+
+
+class Auth(object):
+
+    def get_key(self):
+        return 'key'
+
+    def get_secret(self):
+        return 'c2VjcmV0'
+
+
+class FakeKraken(Kraken):
+
+    def __init__(self, positions, bid='150', ask='151'):
+        super(FakeKraken, self).__init__(Auth())
+        self.positions = positions
+        self.book = {'bids': [[bid, '5', 0]], 'asks': [[ask, '5', 0]]}
+        self.sent = []
+
+    def _public(self, method, params=None):
+        if method == 'AssetPairs':
+            return {'error': [], 'result': ASSET_PAIRS}
+        if method == 'Depth':
+            return {'error': [], 'result': {'XXBTZUSD': self.book}}
+        return {'error': ['EGeneral:Unknown method']}
+
+    def _private(self, method, data=None):
+        if method == 'OpenPositions':
+            return {'error': [], 'result': self.positions}
+        if method == 'AddOrder':
+            self.sent.append(dict(data))
+            return {'error': [], 'result': {'txid': ['T{}'.format(len(self.sent))]}}
+        return {'error': ['EGeneral:Unknown method']}
+
+
+def long_position():
+    return {'P1': {'pair': 'XXBTZUSD', 'type': 'buy', 'vol': '1', 'vol_closed': '0', 'cost': '100', 'net': '0'}}
+
+
+def test_reversal_takes_the_fill_price():
+    book = MarginBook()
+    book.apply_fill('XBTUSD', 'buy', Decimal(1), Decimal(100))
+    book.apply_fill('XBTUSD', 'sell', Decimal(2), Decimal(150))
+    position = book.get('XBTUSD')
+    assert (position.side, position.amount, position.base_price) == ('short', 1, 150)
+    assert position.realized == 50
+    assert book.mark('XBTUSD', 149, 150) == 0
+
+
+def test_unknown_entry_is_not_marked():
+    book = MarginBook()
+    book.load([('XBTUSD', 'long', Decimal(1), None)])
+    assert book.mark('XBTUSD', 150, 151) is None
+
+
+def test_kraken_positions_use_altnames():
+    client = FakeKraken(long_position())
+    positions = client.get_margin_position()
+    assert [p.symbol for p in positions] == ['XBTUSD']
+    assert client.margin.get('XBTUSD').amount == 1
+
+
+def test_kraken_close_by_returned_symbol():
+    client = FakeKraken(long_position())
+    position = client.get_margin_position()[0]
+    assert client.close_margin_position(position.symbol)
+    assert [(o['pair'], o['type'], o['volume']) for o in client.sent] == [('XBTUSD', 'sell', 1)]
+    assert client.margin.positions() == []
+
+
+def test_kraken_toggle_reverses_one_position():
+    client = FakeKraken(long_position())
+    position = client.get_margin_position()[0]
+    client.toggle_margin_positions(position)
+    assert [(o['pair'], o['type'], o['volume']) for o in client.sent] == [('XBTUSD', 'sell', 2)]
+    positions = client.margin.positions()
+    assert [(p.symbol, p.side, p.amount, p.base_price) for p in positions] == [('XBTUSD', 'short', 1, 150)]
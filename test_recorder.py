@@ -0,0 +1,17 @@
+from exchange_api.recorder import BID, TickReader, TickWriter
+
+
+def write(path, timestamps, chunk_size):
+    writer = TickWriter(path, chunk_size=chunk_size)
+    for ts in timestamps:
+        writer.write(ts, 'BTCUSDT', BID, 100 + ts, 1)
+    writer.close()
+    return TickReader(path)
+
+
+def test_overlapping_chunks_replay_in_time_order(tmp_path):
+    # Stored as chunks [1, 3, 5], [2, 7, 9] and [8]
+    reader = write(str(tmp_path / 'ticks'), [5, 1, 3, 2, 9, 7, 8], chunk_size=3)
+    assert [r[0] for r in reader.replay()] == [1, 2, 3, 5, 7, 8, 9]
+    assert [r[0] for r in reader.replay(start=3, end=8)] == [3, 5, 7]
+    assert [r[3] for r in reader.replay(start=8)] == [108, 109]
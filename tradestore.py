@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fills (
+    venue TEXT NOT NULL,
+    id TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    order_id TEXT,
+    side TEXT NOT NULL,
+    price REAL NOT NULL,
+    amount REAL NOT NULL,
+    fee REAL NOT NULL,
+    fee_asset TEXT,
+    time INTEGER NOT NULL,
+    PRIMARY KEY (venue, id)
+);
+CREATE INDEX IF NOT EXISTS fills_symbol_time ON fills (venue, symbol, time);
+CREATE INDEX IF NOT EXISTS fills_time ON fills (time);
+'''
+
+COLUMNS = ('venue', 'id', 'symbol', 'order_id', 'side', 'price', 'amount', 'fee', 'fee_asset', 'time')
+
+
+class TradeStore(object):
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def last_fill(self, venue, symbol):
+        with self._lock:
+            cursor = self._db.execute(
+                'SELECT id, time FROM fills WHERE venue = ? AND symbol = ? ORDER BY time DESC, id DESC LIMIT 1',
+                (venue, symbol))
+            return cursor.fetchone() or (None, None)
+
+    def append(self, venue, rows):
+        values = [(venue, str(r['id']), r['symbol'], str(r['order_id']), r['side'], float(r['price']),
+                   float(r['amount']), float(r['fee']), r['fee_asset'], int(r['time'])) for r in rows]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR IGNORE INTO fills VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', values)
+        return len(values)
+
+    def sync(self, client, symbol):
+        venue = type(client).__name__
+        since_id, since_time = self.last_fill(venue, symbol)
+        rows = client.get_fills(symbol, since_id=since_id, since_time=since_time)
+        if rows is None:
+            return None
+        return self.append(venue, rows)
+
+    def sync_all(self, client, symbols, max_concurrency=4):
+        if hasattr(client, 'get_fills_by_symbol'):
+            return self._sync_account(client, symbols)
+        result = {}
+        for symbol, added, error in client.for_symbols(
+                lambda s: self.sync(client, s), symbols, max_concurrency):
+            result[symbol] = error if error is not None else added
+        return result
+
+    def _sync_account(self, client, symbols):
+        # Venues with an account-wide fill history are downloaded once from the oldest sync point
+        venue = type(client).__name__
+        times = [self.last_fill(venue, symbol)[1] for symbol in symbols]
+        since_time = None if None in times else min(times)
+        fills = client.get_fills_by_symbol(symbols, since_time)
+        if fills is None:
+            return dict((symbol, None) for symbol in symbols)
+        return dict((symbol, self.append(venue, rows)) for symbol, rows in fills.items())
+
+    def _where(self, venue, symbol, start, end):
+        clauses, params = [], []
+        for clause, value in (('venue = ?', venue), ('symbol = ?', symbol), ('time >= ?', start), ('time < ?', end)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def fills(self, venue=None, symbol=None, start=None, end=None):
+        where, params = self._where(venue, symbol, start, end)
+        cursor = self._db.execute('SELECT {} FROM fills{} ORDER BY time'.format(', '.join(COLUMNS), where), params)
+        for row in cursor:
+            yield dict(zip(COLUMNS, row))
+
+    def volume(self, venue=None, symbol=None, start=None, end=None):
+        where, params = self._where(venue, symbol, start, end)
+        cursor = self._db.execute(
+            'SELECT venue, symbol, SUM(amount), SUM(price * amount), COUNT(*) FROM fills{} '
+            'GROUP BY venue, symbol'.format(where), params)
+        return dict(((v, s), {'amount': a, 'notional': n, 'count': c}) for v, s, a, n, c in cursor)
+
+    def fees(self, venue=None, symbol=None, start=None, end=None):
+        where, params = self._where(venue, symbol, start, end)
+        cursor = self._db.execute(
+            'SELECT venue, fee_asset, SUM(fee) FROM fills{} GROUP BY venue, fee_asset'.format(where), params)
+        return dict(((v, a), f) for v, a, f in cursor)
+
+    def pnl(self, venue=None, symbol=None, start=None, end=None):
+        # Realized cash flow in the quote currency plus the net base position left open
+        where, params = self._where(venue, symbol, start, end)
+        cursor = self._db.execute(
+            "SELECT venue, symbol, "
+            "SUM(CASE WHEN side = 'sell' THEN price * amount ELSE -price * amount END), "
+            "SUM(CASE WHEN side = 'buy' THEN amount ELSE -amount END) "
+            "FROM fills{} GROUP BY venue, symbol".format(where), params)
+        return dict(((v, s), {'cash': c, 'position': p}) for v, s, c, p in cursor)
+
+    def close(self):
+        self._db.close()
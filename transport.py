@@ -0,0 +1,86 @@
+import threading
+
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    # urllib3 and httpx decode brotli bodies on the fly once a brotli package is importable
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'br, gzip, deflate'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+HEADERS = {
+    'Accept-Encoding': ACCEPT_ENCODING,
+    'User-Agent': 'exchange_api',
+}
+
+TRANSPORT_ERRORS = (requests.RequestException,) + ((httpx.HTTPError,) if httpx is not None else ())
+
+
+class Transport(object):
+
+    def __init__(self, http2=False, pool_size=32):
+        if http2 and httpx is None:
+            raise ImportError("HTTP/2 transport requires httpx[http2]")
+        self.http2 = http2
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+        if http2:
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            self._client = httpx.Client(http2=True, headers=HEADERS, limits=limits)
+
+    def _session(self):
+        # requests.Session is not thread-safe, each thread keeps its own keep-alive connections
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            self._local.session = session
+            with self._lock:
+                # Sessions of threads that have exited (cache refreshers, reconcilers) are closed here
+                # instead of holding their sockets until close()
+                dead = [s for thread, s in self._sessions if not thread.is_alive()]
+                self._sessions = [(thread, s) for thread, s in self._sessions if thread.is_alive()]
+                self._sessions.append((threading.current_thread(), session))
+            for s in dead:
+                s.close()
+        return session
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        if not self.http2:
+            return self._session().request(method, url, params=params, data=data, headers=headers, timeout=timeout)
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        if isinstance(data, (str, bytes)):
+            return self._client.request(method, url, params=params, content=data, headers=headers, timeout=timeout)
+        return self._client.request(method, url, params=params, data=data, headers=headers, timeout=timeout)
+
+    def close(self):
+        if self.http2:
+            self._client.close()
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for _, session in sessions:
+            session.close()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_transport():
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = Transport()
+    return _default